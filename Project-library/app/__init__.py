@@ -3,8 +3,11 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flasgger import Swagger
 from flask_pymongo import PyMongo
-import redis
 from flask_caching import Cache
+from .log_writer import LogWriter
+from .local_cache import LocalCache
+from .serializers import init_serializer
+from .pools import engine_options, mongo_options, create_redis_client
 
 db = SQLAlchemy()
 login_manager = LoginManager()
@@ -12,16 +15,30 @@ swagger = Swagger()
 mongo = PyMongo()
 redis_client = None
 cache = Cache()
+log_writer = LogWriter()
+l1_cache = LocalCache()
 
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.config.from_object('app.config.Config')
+    # Переопределение настроек (бенчмарки, локальный запуск)
+    if config:
+        app.config.update(config)
 
-    # Настройка кэша
+    # Пул SQLAlchemy из DB_POOL_*; явные SQLALCHEMY_ENGINE_OPTIONS имеют приоритет
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**engine_options(app),
+                                               **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+
+    # Инициализация Redis
+    global redis_client
+    redis_client = create_redis_client(app)
+
+    # Настройка кэша: Flask-Caching использует тот же клиент и пул, что и redis_client
     cache_config = {
-        'CACHE_TYPE': 'redis',
-        'CACHE_REDIS_URL': app.config['REDIS_URL'],
+        # С включённым L1 Flask-Caching работает через двухуровневый бэкенд
+        'CACHE_TYPE': 'app.local_cache.TwoTierRedisCache' if app.config['L1_CACHE_ENABLED'] else 'redis',
+        'CACHE_REDIS_HOST': redis_client,
         'CACHE_DEFAULT_TIMEOUT': app.config['CACHE_TIMEOUT']
     }
 
@@ -29,15 +46,108 @@ def create_app():
     db.init_app(app)
     login_manager.init_app(app)
     swagger.init_app(app)
-    mongo.init_app(app)
+    mongo.init_app(app, **mongo_options(app))
     cache.init_app(app, config=cache_config)
-
-    # Инициализация Redis
-    global redis_client
-    redis_client = redis.from_url(app.config['REDIS_URL'])
+    log_writer.init_app(app)
+    l1_cache.init_app(app)
+    init_serializer(app)
 
     with app.app_context():
-        from . import routes, models
+        from . import routes, models, auth
         db.create_all()
+        if app.config.get('SQL_ENSURE_SCHEMA'):
+            ensure_sql_schema(app)
+        if app.config.get('SEARCH_ENSURE_INDEX'):
+            ensure_catalog_search_index(app)
+
+    if app.config.get('MONGO_ENSURE_INDEXES'):
+        ensure_mongo_indexes(app)
+
+    from .cli import register_commands
+    register_commands(app)
+
+    return app
+
+
+def ensure_mongo_indexes(app):
+    """Создание индексов MongoDB; недоступность MongoDB не мешает старту"""
+    from pymongo.errors import PyMongoError
+    from .models_mongo import ensure_indexes
 
-    return app
\ No newline at end of file
+    try:
+        ensure_indexes(
+            retention=app.config.get('LOG_RETENTION'),
+            retention_days=app.config.get('LOG_RETENTION_DAYS'),
+            capped_size_mb=app.config.get('LOG_CAPPED_SIZE_MB')
+        )
+    except PyMongoError as e:
+        app.logger.warning(f"Could not ensure MongoDB indexes: {e}")
+    except RuntimeError as e:
+        # Преобразование logs в ограниченную коллекцию блокирует её и выполняется вручную
+        app.logger.warning(f"Log retention policy is not applied: {e}")
+
+
+def ensure_sql_schema(app):
+    """Досоздание схемы для уже существующих таблиц.
+
+    create_all не меняет существующие таблицы: недостающие nullable-колонки
+    добавляются через ALTER TABLE ADD COLUMN, недостающие индексы моделей
+    создаются. Уникальный индекс не создаётся, пока в таблице есть
+    дубликаты. Остальные изменения требуют ручной миграции.
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+
+    try:
+        inspector = inspect(db.engine)
+        with db.engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    if not column.nullable or column.server_default is not None:
+                        app.logger.warning(f"Column {table.name}.{column.name} requires a manual migration")
+                        continue
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(bind=db.engine, checkfirst=True)
+                except IntegrityError:
+                    # Уникальный индекс поверх существующих дубликатов: нужна миграция данных
+                    app.logger.warning(f"Unique index {index.name} was not created: table {table.name} "
+                                       f"has duplicate rows, run `flask merge-duplicate-books`")
+    except SQLAlchemyError as e:
+        app.logger.warning(f"Could not ensure SQL schema: {e}")
+
+
+def ensure_catalog_search_index(app):
+    """Поисковые индексы каталога; ошибка (например, нет прав на CREATE EXTENSION) не мешает старту"""
+    from sqlalchemy.exc import SQLAlchemyError
+    from .search import ensure_search_index
+
+    try:
+        ensure_search_index()
+    except SQLAlchemyError as e:
+        app.logger.warning(f"Could not ensure catalog search index: {e}")
+
+
+def reinit_after_fork(app):
+    """Пересоздание клиентов БД в воркере после fork (gunicorn с preload_app).
+
+    Сокеты, открытые в master-процессе, нельзя делить между воркерами:
+    MongoClient не fork-safe, а пул SQLAlchemy унаследовал бы чужие
+    соединения. redis_client не пересоздаётся: его пул при смене pid
+    сбрасывается сам, и Flask-Caching продолжает работать через тот же
+    клиент, так что REDIS_MAX_CONNECTIONS ограничивает все соединения воркера.
+    LogWriter и L1-кэш перезапускают свои потоки при первом обращении.
+    """
+    from .pools import mongo_pool_monitor
+
+    mongo_pool_monitor.reset()
+    mongo.init_app(app, **mongo_options(app))
+    with app.app_context():
+        # close=False: соединения родителя не закрываются, а просто забываются
+        db.engine.dispose(close=False)
\ No newline at end of file
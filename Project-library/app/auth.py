@@ -1,4 +1,63 @@
+import time
+import jwt
+from flask import current_app, request
+from flask_login import UserMixin
+from . import db, login_manager
 from .models import User
+from .utils import decode_token
+from .cache import get_redis
 
+
+class TokenUser(UserMixin):
+    """Пользователь из claims access-токена: user_id и role без запроса к БД"""
+
+    def __init__(self, user_id, role, jti=None, exp=None):
+        self.user_id = user_id
+        self.role = role
+        self.jti = jti
+        self.exp = exp
+
+    def get_id(self):
+        return str(self.user_id)
+
+
+@login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
+
+
+def _bearer_auth_enabled():
+    if not current_app.config.get('JWT_AUTH_ENABLED', True):
+        return False
+    return request.blueprint not in current_app.config.get('JWT_AUTH_EXEMPT_BLUEPRINTS', ())
+
+
+def _revoked_key(jti):
+    return f"auth:revoked:{jti}"
+
+
+def revoke_token(jti, exp):
+    """Отзыв токена; запись в denylist живёт не дольше самого токена"""
+    ttl = int(exp - time.time())
+    if ttl > 0:
+        get_redis().set(_revoked_key(jti), 1, ex=ttl)
+
+
+def is_token_revoked(jti):
+    return jti is not None and get_redis().exists(_revoked_key(jti)) > 0
+
+
+@login_manager.request_loader
+def load_user_from_request(request):
+    """Аутентификация по заголовку Authorization: Bearer <access token>"""
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer ') or not _bearer_auth_enabled():
+        return None
+    try:
+        payload = decode_token(header[len('Bearer '):], 'access')
+    except jwt.InvalidTokenError:
+        return None
+    if is_token_revoked(payload.get('jti')):
+        return None
+    # Access-токены с полем type всегда содержат role: /refresh/ берёт её из БД для старых refresh-токенов
+    return TokenUser(payload['user_id'], payload['role'], payload.get('jti'), payload.get('exp'))
@@ -0,0 +1,88 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response, current_app
+from . import db
+from .models import Book
+from .models_mongo import LogEntry, BookReview, RatingSummary
+from .cache import cached, book_cache_key, delete_cache
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Общий пул потоков для параллельных запросов к БД.
+
+    После fork потоки родителя в дочернем процессе не работают, поэтому
+    пул создаётся заново при смене pid.
+    """
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=current_app.config['BOOK_DETAIL_WORKERS'],
+                                               thread_name_prefix='book-detail')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _submit(app, fn, *args):
+    # У каждой задачи свой контекст приложения, а значит и своя сессия SQLAlchemy
+    def run():
+        with app.app_context():
+            return fn(*args)
+    return _get_executor().submit(run)
+
+
+def _fetch_book(book_id):
+    book = db.session.get(Book, book_id)
+    return book.to_dict() if book is not None else None
+
+
+def _fetch_activity(book_id, limit):
+    # Карточка доступна без входа: кто брал книгу, в ответ не попадает
+    return [
+        {"action": entry.get("action"), "timestamp": entry.get("timestamp")}
+        for entry in LogEntry.get_book_activity(book_id, limit)
+    ]
+
+
+def detail_cache_key(book_id):
+    return book_cache_key(f"detail:{book_id}")
+
+
+@cached('book:v{generation}:detail:{0}')
+def get_book_detail(book_id):
+    """Карточка книги: строка из Postgres, последние отзывы, сводка оценок и
+    активность из MongoDB. Запросы выполняются параллельно, поэтому задержка
+    равна самому медленному из них, а не их сумме.
+
+    Возвращает готовый JSON-ответ или False, если книги нет: отсутствие
+    тоже кэшируется до смены поколения, и повторные 404 не обращаются к базам.
+    Ключ кэша входит в поколение каталога (аренда, возврат и добавление книги
+    его сбрасывают), после нового отзыва запись удаляется через invalidate_book_detail.
+    """
+    app = current_app._get_current_object()
+    book = _submit(app, _fetch_book, book_id)
+    reviews = _submit(app, BookReview.get_book_reviews, book_id, app.config['BOOK_DETAIL_REVIEWS'])
+    rating = _submit(app, RatingSummary.get, book_id)
+    activity = _submit(app, _fetch_activity, book_id, app.config['BOOK_DETAIL_ACTIVITY'])
+
+    book = book.result()
+    if book is None:
+        return False
+    reviews, next_cursor = reviews.result()
+    payload = {
+        "book": book,
+        "reviews": reviews,
+        "reviews_next_cursor": next_cursor,
+        "rating": rating.result(),
+        "activity": activity.result()
+    }
+    return Response(current_app.json.dumps(payload), mimetype='application/json')
+
+
+def invalidate_book_detail(book_id):
+    delete_cache(detail_cache_key(book_id))
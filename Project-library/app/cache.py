@@ -1,20 +1,85 @@
-from . import redis_client
-import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
 from functools import wraps
-from flask import current_app
-from .serializers import serialize_for_cache, deserialize_from_cache
+from flask import current_app, has_request_context, copy_current_request_context
+from .serializers import get_serializer
+
+# Счётчик поколений каталога: входит во все ключи, связанные с книгами
+CATALOG_GENERATION_KEY = 'catalog:generation'
+# Версия сводок оценок: входит в ключи страниц каталога с оценками
+RATINGS_VERSION_KEY = 'ratings:version'
+# Версия результатов поиска: меняется только при изменении состава каталога, не при аренде
+SEARCH_VERSION_KEY = 'search:version'
+# Эпоха счётчиков: случайный идентификатор, пропадающий вместе с ними
+CACHE_EPOCH_KEY = 'cache:epoch'
+
+# Метаданные записи декоратора cached: мягкий срок жизни и время вычисления
+_ENTRY_META = struct.Struct('>dd')
+_LOCK_POLL_INTERVAL = 0.05
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Счётчики обращений к Redis (L2); счётчики L1 ведёт l1_cache
+redis_stats = {"hits": 0, "misses": 0}
+
+
+def get_redis():
+    # Клиент создаётся в create_app, поэтому берём его из пакета при каждом вызове
+    from . import redis_client
+    return redis_client
+
+
+def record_redis_lookup(hit):
+    redis_stats["hits" if hit else "misses"] += 1
+
+
+def get_raw(key):
+    """Чтение сырых байтов: сначала L1 в процессе, затем Redis"""
+    from . import l1_cache
+
+    data = l1_cache.get(key)
+    if data is None:
+        epoch = l1_cache.epoch
+        data = get_redis().get(key)
+        record_redis_lookup(data is not None)
+        l1_cache.set(key, data, epoch=epoch)
+    return data
+
+
+def set_raw(key, data, timeout=None):
+    """Запись сырых байтов в Redis с инвалидацией L1 во всех воркерах"""
+    from . import l1_cache
+
+    if timeout is None:
+        get_redis().set(key, data)
+    else:
+        get_redis().setex(key, timeout, data)
+    l1_cache.invalidate(key)
+
+
+def cache_stats():
+    """Счётчики попаданий/промахов по уровням кэша"""
+    from . import l1_cache
+
+    return {
+        "l1": l1_cache.stats(),
+        "l2": dict(redis_stats)
+    }
 
 
 def get_cache(key):
-    """Получение данных из кэша Redis"""
-    data = redis_client.get(key)
+    """Получение данных из кэша (L1, затем Redis)"""
+    data = get_raw(key)
     if data:
-        try:
-            cached_data = json.loads(data)
-            return deserialize_from_cache(cached_data)
-        except json.JSONDecodeError:
-            # Если не удалось декодировать JSON, возвращаем None
-            return None
+        return get_serializer().loads(data)
     return None
 
 
@@ -23,14 +88,10 @@ def set_cache(key, value, timeout=None):
     if timeout is None:
         timeout = current_app.config.get('CACHE_TIMEOUT', 300)
 
-    # Преобразуем объект для кэширования
-    serializable_value = serialize_for_cache(value)
-
     try:
-        # Сериализуем в JSON и сохраняем
-        redis_client.setex(key, timeout, json.dumps(serializable_value))
+        set_raw(key, get_serializer().dumps(value), timeout)
         return True
-    except (TypeError, OverflowError) as e:
+    except (TypeError, ValueError, OverflowError) as e:
         # В случае ошибки записываем лог и не кэшируем
         current_app.logger.error(f"Cache serialization error: {e}")
         return False
@@ -38,17 +99,169 @@ def set_cache(key, value, timeout=None):
 
 def delete_cache(key):
     """Удаление данных из кэша Redis"""
-    redis_client.delete(key)
+    from . import l1_cache
+
+    get_redis().delete(key)
+    l1_cache.invalidate(key)
+
+
+def get_catalog_generation():
+    """Текущее поколение каталога книг"""
+    value = get_raw(CATALOG_GENERATION_KEY)
+    return int(value) if value else 0
+
+
+def get_cache_epoch():
+    """Эпоха счётчиков поколений и версий; создаётся заново, если ключа нет.
+
+    После FLUSHDB или перезапуска Redis без сохранения счётчики начинаются
+    с нуля, а новая эпоха не даёт старым ETag совпасть с новыми.
+    """
+    value = get_raw(CACHE_EPOCH_KEY)
+    if value is None:
+        get_redis().set(CACHE_EPOCH_KEY, uuid.uuid4().hex[:8], nx=True)
+        value = get_redis().get(CACHE_EPOCH_KEY)
+    return value.decode()
+
+
+def book_cache_key(name, generation=None):
+    """Ключ кэша в пространстве имён текущего поколения каталога"""
+    if generation is None:
+        generation = get_catalog_generation()
+    return f"book:v{generation}:{name}"
 
 
 def clear_book_cache():
-    """Очистка кэша связанного с книгами"""
-    for key in redis_client.scan_iter("book:*"):
-        redis_client.delete(key)
+    """Инвалидация кэша книг.
+
+    Вместо SCAN/DELETE атомарно увеличивается поколение каталога: ключи
+    старого поколения больше не читаются и истекают по своему TTL.
+    Общие ответы дашборда пересобираются в фоне.
+    """
+    from . import l1_cache
+    from .dashboard import schedule_rebuild
+
+    generation = get_redis().incr(CATALOG_GENERATION_KEY)
+    l1_cache.invalidate(CATALOG_GENERATION_KEY)
+    schedule_rebuild()
+    return generation
+
+
+def _review_version_key(book_id):
+    return f"reviews:{book_id}:version"
+
+
+def get_review_version(book_id):
+    """Версия отзывов книги: растёт с каждым новым отзывом"""
+    value = get_raw(_review_version_key(book_id))
+    return int(value) if value else 0
+
 
+def bump_review_version(book_id):
+    from . import l1_cache
 
-def cached(key_format):
-    """Декоратор для кэширования результатов функций"""
+    key = _review_version_key(book_id)
+    version = get_redis().incr(key)
+    l1_cache.invalidate(key)
+    return version
+
+
+def get_ratings_version():
+    """Версия сводок оценок: растёт с каждым новым отзывом и пересчётом сводок"""
+    value = get_raw(RATINGS_VERSION_KEY)
+    return int(value) if value else 0
+
+
+def bump_ratings_version():
+    from . import l1_cache
+
+    version = get_redis().incr(RATINGS_VERSION_KEY)
+    l1_cache.invalidate(RATINGS_VERSION_KEY)
+    return version
+
+
+def get_search_version():
+    """Версия результатов поиска: растёт при добавлении, импорте и слиянии книг"""
+    value = get_raw(SEARCH_VERSION_KEY)
+    return int(value) if value else 0
+
+
+def bump_search_version():
+    from . import l1_cache
+
+    version = get_redis().incr(SEARCH_VERSION_KEY)
+    l1_cache.invalidate(SEARCH_VERSION_KEY)
+    return version
+
+
+def _acquire_lock(key, lock_timeout):
+    """Короткая блокировка пересчёта ключа (single-flight); возвращает токен или None"""
+    token = uuid.uuid4().hex
+    if get_redis().set(f"lock:{key}", token, nx=True, ex=lock_timeout):
+        return token
+    return None
+
+
+def release_lock(lock_key, token):
+    """Снятие блокировки только её владельцем.
+
+    Сравнение и удаление одной командой: блокировку, истёкшую и взятую
+    другим процессом между GET и DEL, не удалить.
+    """
+    get_redis().eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+def _release_lock(key, token):
+    release_lock(f"lock:{key}", token)
+
+
+def _store_entry(key, value, timeout, soft_ttl, delta):
+    """Запись значения с метаданными: мягкий срок жизни и время вычисления"""
+    try:
+        data = _ENTRY_META.pack(time.time() + soft_ttl, delta) + get_serializer().dumps(value)
+    except (TypeError, ValueError, OverflowError) as e:
+        current_app.logger.error(f"Cache serialization error: {e}")
+        return
+    set_raw(key, data, timeout)
+
+
+def _load_entry(key):
+    """(soft_expires_at, delta, value) или None"""
+    data = get_raw(key)
+    if not data or len(data) < _ENTRY_META.size:
+        return None
+    soft_expires_at, delta = _ENTRY_META.unpack_from(data)
+    value = get_serializer().loads(data[_ENTRY_META.size:])
+    if value is None:
+        return None
+    return soft_expires_at, delta, value
+
+
+def _run_in_background(fn):
+    """Запуск fn в отдельном потоке с копией контекста запроса или приложения"""
+    if has_request_context():
+        target = copy_current_request_context(fn)
+    else:
+        app = current_app._get_current_object()
+
+        def target():
+            with app.app_context():
+                fn()
+    threading.Thread(target=target, daemon=True).start()
+
+
+def cached(key_format, timeout=None, soft_ttl=None, lock_timeout=10, wait=2.0, beta=1.0):
+    """Декоратор для кэширования результатов функций.
+
+    timeout — жёсткий TTL записи в Redis (по умолчанию CACHE_TIMEOUT).
+    soft_ttl — через сколько секунд запись считается устаревшей: до жёсткого
+    TTL она ещё отдаётся, а пересчёт идёт в фоне одним воркером
+    (stale-while-revalidate). По умолчанию равен timeout.
+    beta — вероятностное досрочное обновление (XFetch): чем дольше
+    вычисляется значение, тем раньше до истечения начинается пересчёт; 0 отключает.
+    При промахе значение вычисляет только владелец блокировки на
+    lock_timeout секунд, остальные ждут его результата до wait секунд.
+    """
 
     def decorator(f):
         @wraps(f)
@@ -63,24 +276,65 @@ def cached(key_format):
                 key = key.replace('{user_id}', str(current_user.user_id))
             if '{role}' in key and hasattr(current_user, 'role'):
                 key = key.replace('{role}', str(current_user.role))
+            if '{generation}' in key:
+                key = key.replace('{generation}', str(get_catalog_generation()))
 
             for i, arg in enumerate(args):
                 key = key.replace(f"{{{i}}}", str(arg))
             for k, v in kwargs.items():
                 key = key.replace(f"{{{k}}}", str(v))
 
+            hard_ttl = timeout or current_app.config.get('CACHE_TIMEOUT', 300)
+            soft = min(soft_ttl or hard_ttl, hard_ttl)
+
+            def compute_and_store():
+                started = time.perf_counter()
+                result = f(*args, **kwargs)
+                _store_entry(key, result, hard_ttl, soft, time.perf_counter() - started)
+                return result
+
+            def refresh(token):
+                try:
+                    compute_and_store()
+                except Exception:
+                    current_app.logger.exception(f"Background cache refresh failed for {key}")
+                finally:
+                    _release_lock(key, token)
+
             # Проверка кэша
-            cached_result = get_cache(key)
-            if cached_result is not None:
-                return cached_result
+            entry = _load_entry(key)
+            if entry is not None:
+                soft_expires_at, delta, value = entry
+                now = time.time()
+                # XFetch: досрочное обновление с вероятностью, растущей к концу срока
+                if beta and delta:
+                    now -= delta * beta * math.log(random.random() or 1e-12)
+                if now < soft_expires_at:
+                    return value
+                # Запись устарела: отдаём её, пересчитывает один воркер в фоне
+                token = _acquire_lock(key, lock_timeout)
+                if token is not None:
+                    _run_in_background(lambda: refresh(token))
+                return value
 
-            result = f(*args, **kwargs)
+            # Промах: пересчитывает только владелец блокировки
+            token = _acquire_lock(key, lock_timeout)
+            if token is not None:
+                try:
+                    return compute_and_store()
+                finally:
+                    _release_lock(key, token)
 
-            # Сохранение результата в кэш
-            set_cache(key, result)
+            deadline = time.monotonic() + wait
+            while time.monotonic() < deadline:
+                time.sleep(_LOCK_POLL_INTERVAL)
+                entry = _load_entry(key)
+                if entry is not None:
+                    return entry[2]
 
-            return result
+            # Владелец блокировки не успел: вычисляем сами, не дожидаясь дальше
+            return f(*args, **kwargs)
 
         return decorated_function
 
-    return decorator
\ No newline at end of file
+    return decorator
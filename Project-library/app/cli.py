@@ -0,0 +1,150 @@
+import os
+import click
+from flask import current_app
+
+
+def register_commands(app):
+    """Регистрация CLI-команд приложения (flask <command>)"""
+
+    @app.cli.command('import-books')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+                  help='File format (by default derived from the extension)')
+    @click.option('--batch-size', type=int, default=None, help='Rows per INSERT batch')
+    def import_books_command(path, fmt, batch_size):
+        """Потоковый импорт каталога из CSV или JSON Lines"""
+        from .importer import import_books
+
+        if fmt is None:
+            fmt = 'csv' if os.path.splitext(path)[1].lower() == '.csv' else 'jsonl'
+
+        def progress(summary):
+            click.echo(f"batch {summary['batches']}: {summary['upserted']} upserted, "
+                       f"{summary['skipped']} skipped, {summary['elapsed']}s")
+
+        with open(path, 'rb') as f:
+            summary = import_books(f, fmt,
+                                   batch_size=batch_size or current_app.config['IMPORT_BATCH_SIZE'],
+                                   progress=progress)
+        for error in summary['errors']:
+            click.echo(f"record {error['record']}: {error['error']}", err=True)
+        click.echo(f"done: {summary['rows']} rows, {summary['upserted']} upserted, "
+                   f"{summary['skipped']} skipped in {summary['elapsed']}s")
+
+    @app.cli.command('merge-duplicate-books')
+    def merge_duplicate_books_command():
+        """Слияние книг с одинаковыми (title, author) и создание уникального индекса для импорта"""
+        from .importer import merge_duplicate_books, ensure_natural_key
+        from .popularity import rebuild_popularity
+
+        merged = merge_duplicate_books()
+        ensure_natural_key()
+        if merged:
+            # В рейтинге популярных могли остаться book_id удалённых дубликатов
+            rebuild_popularity()
+        click.echo(f"Merged {merged} duplicate book(s); unique index on (title, author) is in place")
+
+    @app.cli.command('ensure-indexes')
+    def ensure_indexes_command():
+        """Создание индексов MongoDB и политики хранения логов"""
+        from .models_mongo import ensure_indexes
+
+        ensure_indexes(
+            retention=current_app.config.get('LOG_RETENTION'),
+            retention_days=current_app.config.get('LOG_RETENTION_DAYS'),
+            capped_size_mb=current_app.config.get('LOG_CAPPED_SIZE_MB')
+        )
+        click.echo("MongoDB indexes are up to date")
+
+    @app.cli.command('recompute-ratings')
+    @click.option('--book-id', type=int, default=None, help='Recompute a single book')
+    def recompute_ratings_command(book_id):
+        """Полный пересчёт сводок оценок по отзывам"""
+        from .models_mongo import RatingSummary
+        from .cache import bump_ratings_version
+
+        count = RatingSummary.recompute(book_id)
+        bump_ratings_version()
+        click.echo(f"Recomputed rating summaries for {count} book(s)")
+
+    @app.cli.command('rebuild-popular')
+    @click.option('--batch-size', type=int, default=10000, help='Rows fetched per round trip')
+    def rebuild_popular_command(batch_size):
+        """Пересчёт рейтинга популярных книг по таблице rentals"""
+        from .popularity import rebuild_popularity
+
+        count = rebuild_popularity(batch_size)
+        click.echo(f"Rebuilt popularity ranking for {count} book(s)")
+
+    @app.cli.command('scan-overdue')
+    @click.option('--date', 'as_of', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Check date (default: today, UTC)')
+    @click.option('--batch-size', type=int, default=None, help='Rows per server-side cursor batch')
+    @click.option('--restart', is_flag=True, help='Ignore the checkpoint and scan from the beginning')
+    def scan_overdue_command(as_of, batch_size, restart):
+        """Поиск просроченных аренд и запись уведомлений"""
+        from .overdue import scan_overdue
+
+        def progress(summary):
+            click.echo(f"batch {summary['batches']}: {summary['rows']} overdue, {summary['notified']} notified, "
+                       f"{summary['rows_per_sec']} rows/s")
+
+        summary = scan_overdue(
+            as_of=as_of.date() if as_of else None,
+            batch_size=batch_size or current_app.config['OVERDUE_BATCH_SIZE'],
+            resume=not restart,
+            progress=progress
+        )
+        if summary.get('already_finished'):
+            click.echo(f"scan for {summary.get('as_of')} already finished; use --restart to run again")
+            return
+        click.echo(f"done: {summary['rows']} overdue rentals, {summary['notified']} notifications "
+                   f"in {summary['elapsed']}s ({summary['rows_per_sec']} rows/s)")
+
+    @app.cli.command('export-logs')
+    @click.argument('path', type=click.Path(dir_okay=False))
+    @click.option('--start', type=click.DateTime(), default=None, help='Lower bound of timestamp (UTC, inclusive)')
+    @click.option('--end', type=click.DateTime(), default=None, help='Upper bound of timestamp (UTC, exclusive)')
+    @click.option('--action', 'actions', multiple=True, help='Action to export (repeatable), all by default')
+    @click.option('--gzip', 'compress', is_flag=True, help='Write gzip-compressed NDJSON')
+    @click.option('--batch-size', type=int, default=None, help='Documents per cursor batch')
+    @click.option('--restart', is_flag=True, help='Ignore the checkpoint and export from the beginning')
+    def export_logs_command(path, start, end, actions, compress, batch_size, restart):
+        """Потоковая выгрузка логов MongoDB в NDJSON"""
+        from .log_export import export_logs
+
+        def progress(summary):
+            click.echo(f"chunk {summary['chunks']}: {summary['rows']} rows, {summary['bytes']} bytes, "
+                       f"{summary['rows_per_sec']} rows/s")
+
+        try:
+            summary = export_logs(path, start=start, end=end, actions=list(actions), compress=compress,
+                                  batch_size=batch_size, resume=not restart, progress=progress)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        if summary.get('already_finished'):
+            click.echo(f"export to {path} already finished; use --restart to run again")
+            return
+        click.echo(f"done: {summary['rows']} rows, {summary['bytes']} bytes "
+                   f"in {summary['elapsed']}s ({summary['rows_per_sec']} rows/s)")
+
+    @app.cli.command('rollup-activity')
+    @click.option('--batch-size', type=int, default=None, help='Log entries read per round trip')
+    @click.option('--since', type=click.DateTime(), default=None,
+                  help='Recompute rollups from this time (UTC), e.g. after entries arrived later than the grace window')
+    @click.option('--rebuild', is_flag=True, help='Drop the rollups and fold all stored logs again')
+    def rollup_activity_command(batch_size, since, rebuild):
+        """Пересчёт почасовых и посуточных счётчиков по новым записям логов"""
+        from .rollups import rollup_activity
+
+        def progress(summary):
+            click.echo(f"bucket {summary['buckets']}: {summary['rows']} entries, {summary['counters']} counters, "
+                       f"up to {summary['high_water_mark']}, {summary['rows_per_sec']} rows/s")
+
+        summary = rollup_activity(batch_size=batch_size, rebuild=rebuild, since=since, progress=progress)
+        if summary.get('locked'):
+            click.echo("another rollup run is in progress")
+            return
+        click.echo(f"done: {summary['rows']} entries from {summary['rescanned_from']}, "
+                   f"{summary['buckets']} hourly buckets recomputed in {summary['elapsed']}s; "
+                   f"high-water mark {summary['high_water_mark']}")
@@ -1,12 +1,151 @@
+import os
+
+
+def _env(name, default, cast=str):
+    """Значение из переменной окружения; пустая строка — как отсутствие"""
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    if cast is bool:
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return cast(value)
+
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = "postgresql+psycopg2://postgres:1234@db:5432/postgres"
+    SQLALCHEMY_DATABASE_URI = _env('DATABASE_URL', "postgresql+psycopg2://postgres:1234@db:5432/postgres")
     SECRET_KEY = 'liba'
 
+    # Bearer-аутентификация по access-токену (Authorization: Bearer <token>)
+    JWT_AUTH_ENABLED = True
+    JWT_AUTH_EXEMPT_BLUEPRINTS = ()
+
     # MongoDB конфигурация
-    MONGO_URI = "mongodb://mongo:27017/library"
+    MONGO_URI = _env('MONGO_URI', "mongodb://mongo:27017/library")
+
+    # Создание индексов MongoDB при старте приложения
+    MONGO_ENSURE_INDEXES = True
+
+    # Политика хранения логов: None (без ограничений), 'ttl' или 'capped'.
+    # Удаление логов включается только явно в настройках развёртывания
+    LOG_RETENTION = _env('LOG_RETENTION', None)
+    LOG_RETENTION_DAYS = _env('LOG_RETENTION_DAYS', 90, int)
+    LOG_CAPPED_SIZE_MB = _env('LOG_CAPPED_SIZE_MB', 1024, int)
 
     # Redis конфигурация
-    REDIS_URL = "redis://redis:6379/0"
+    REDIS_URL = _env('REDIS_URL', "redis://redis:6379/0")
+
+    # Пул соединений PostgreSQL (на каждый процесс-воркер)
+    DB_POOL_SIZE = _env('DB_POOL_SIZE', 10, int)
+    DB_MAX_OVERFLOW = _env('DB_MAX_OVERFLOW', 10, int)
+    DB_POOL_RECYCLE = _env('DB_POOL_RECYCLE', 1800, int)  # секунды
+    DB_POOL_PRE_PING = _env('DB_POOL_PRE_PING', True, bool)
+    DB_POOL_TIMEOUT = _env('DB_POOL_TIMEOUT', 10, float)  # ожидание свободного соединения
+    DB_CONNECT_TIMEOUT = _env('DB_CONNECT_TIMEOUT', 5, int)
+    DB_STATEMENT_TIMEOUT_MS = _env('DB_STATEMENT_TIMEOUT_MS', None, int)
+
+    # Пул соединений MongoDB
+    MONGO_MAX_POOL_SIZE = _env('MONGO_MAX_POOL_SIZE', 50, int)
+    MONGO_MIN_POOL_SIZE = _env('MONGO_MIN_POOL_SIZE', 0, int)
+    MONGO_MAX_IDLE_TIME_MS = _env('MONGO_MAX_IDLE_TIME_MS', None, int)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = _env('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000, int)
+    MONGO_CONNECT_TIMEOUT_MS = _env('MONGO_CONNECT_TIMEOUT_MS', 5000, int)
+    MONGO_SOCKET_TIMEOUT_MS = _env('MONGO_SOCKET_TIMEOUT_MS', None, int)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = _env('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000, int)
+
+    # Пул соединений Redis (общий для redis_client и Flask-Caching)
+    REDIS_MAX_CONNECTIONS = _env('REDIS_MAX_CONNECTIONS', 50, int)
+    REDIS_POOL_BLOCKING = _env('REDIS_POOL_BLOCKING', True, bool)
+    REDIS_POOL_TIMEOUT = _env('REDIS_POOL_TIMEOUT', 5, float)  # ожидание свободного соединения
+    REDIS_SOCKET_TIMEOUT = _env('REDIS_SOCKET_TIMEOUT', 5, float)
+    REDIS_SOCKET_CONNECT_TIMEOUT = _env('REDIS_SOCKET_CONNECT_TIMEOUT', 2, float)
+    REDIS_HEALTH_CHECK_INTERVAL = _env('REDIS_HEALTH_CHECK_INTERVAL', 30, int)
 
     # Время жизни кэша (в секундах)
-    CACHE_TIMEOUT = 300  # 5 минут
\ No newline at end of file
+    CACHE_TIMEOUT = 300  # 5 минут
+
+    # In-process кэш (L1) перед Redis с инвалидацией через pub/sub
+    L1_CACHE_ENABLED = True
+    L1_CACHE_MAX_ENTRIES = 1024
+    L1_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    L1_CACHE_TTL = 30  # секунды
+    CACHE_INVALIDATION_CHANNEL = 'cache:invalidate'
+
+    # Кодек кэша: 'json' или 'msgpack'; сжатие zlib для записей от порога (в байтах)
+    CACHE_CODEC = 'json'
+    CACHE_COMPRESS_THRESHOLD = 4096
+    CACHE_COMPRESS_LEVEL = 6
+
+    # Сжатие ответов каталога и отзывов (gzip, brotli при наличии пакета)
+    RESPONSE_COMPRESS_MIN_SIZE = 1024  # байты
+    RESPONSE_GZIP_LEVEL = 6
+    RESPONSE_BROTLI_QUALITY = 5
+
+    # Пагинация каталога
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+    REVIEWS_PAGE_SIZE = 20
+    RENTALS_PAGE_SIZE = 20
+
+    # Карточка книги: потоки параллельных запросов, число отзывов и записей активности
+    BOOK_DETAIL_WORKERS = 16
+    BOOK_DETAIL_REVIEWS = 5
+    BOOK_DETAIL_ACTIVITY = 10
+
+    # Добавление недостающих колонок и индексов моделей в существующие таблицы при старте
+    SQL_ENSURE_SCHEMA = True
+
+    # Политика аренды и ночной поиск просроченных аренд
+    RENTAL_PERIOD_DAYS = 14
+    OVERDUE_BATCH_SIZE = 1000
+
+    # Выгрузка логов в NDJSON: документов на порцию курсора и записей на блок вывода
+    LOG_EXPORT_BATCH_SIZE = 2000
+    LOG_EXPORT_CHUNK_SIZE = 1000
+
+    # Сводки активности: записей лога на порцию, отставание от текущего времени
+    # (записи фоновой очереди успевают дойти до MongoDB), окно повторного пересчёта
+    # перед отметкой прошлого запуска (записи, дописанные с опозданием) и аренда задания
+    ROLLUP_BATCH_SIZE = 5000
+    ROLLUP_LAG_SECONDS = 60
+    ROLLUP_GRACE_SECONDS = 3600
+    ROLLUP_LEASE_SECONDS = 300
+
+    # /stats/: максимальное число корзин в периоде и число значений измерения в ответе
+    STATS_MAX_BUCKETS = 744
+    STATS_DEFAULT_LIMIT = 10
+    STATS_MAX_LIMIT = 100
+
+    # Поиск по каталогу: индексы при старте, глубина выдачи и кэширование популярных запросов
+    SEARCH_ENSURE_INDEX = True
+    SEARCH_PAGE_SIZE = 20
+    SEARCH_MAX_RESULTS = 1000
+    SEARCH_MAX_QUERY_LENGTH = 200
+    SEARCH_CACHE_TIMEOUT = 300  # секунды
+    SEARCH_POPULAR_MIN_HITS = 2
+    SEARCH_POPULAR_WINDOW = 3600  # секунды
+
+    # Рейтинг популярных книг: максимальное скользящее окно и кэш объединённого окна
+    POPULAR_DEFAULT_LIMIT = 10
+    POPULAR_MAX_LIMIT = 100
+    POPULAR_MAX_WINDOW_DAYS = 90
+    POPULAR_WINDOW_CACHE_TTL = 60  # секунды
+
+    # Максимум книг в одном пакетном запросе аренды/возврата
+    MAX_BATCH_RENTALS = 50
+
+    # Размер пакета потокового импорта каталога
+    IMPORT_BATCH_SIZE = 5000
+
+    # Блокировка пересборки общего ответа дашборда и ожидание чужой пересборки
+    # при отсутствии ответа в Redis (в секундах)
+    DASHBOARD_REBUILD_LOCK_TIMEOUT = 30
+    DASHBOARD_REBUILD_WAIT = 2.0
+
+    # Буферизированная запись логов в MongoDB
+    LOG_WRITER_ENABLED = True
+    LOG_BATCH_SIZE = 500
+    LOG_FLUSH_INTERVAL = 1.0  # секунды
+    LOG_QUEUE_SIZE = 10000
+    LOG_OVERFLOW_POLICY = 'drop'  # drop / block / spill
+    LOG_BLOCK_TIMEOUT = 1.0  # секунды ожидания для политики block
+    LOG_SPILL_PATH = '/tmp/library_logs_spill.jsonl'  # файлы <путь>.<pid>, общие для воркеров одного хоста
@@ -0,0 +1,216 @@
+import threading
+import time
+import uuid
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+from .models import Book
+from .models_mongo import RatingSummary
+from .cache import get_catalog_generation, get_ratings_version, book_cache_key, get_redis, get_raw, set_raw, \
+    release_lock
+from .utils import parse_page_args, parse_bool_arg
+
+DASHBOARD_ROLES = ('admin', 'reader')
+_REBUILD_POLL_INTERVAL = 0.05
+
+
+def dashboard_role(role):
+    """Все не-администраторы видят один и тот же каталог"""
+    return 'admin' if role == 'admin' else 'reader'
+
+
+def _payload_key(role):
+    return f"dashboard:{role}:payload"
+
+
+def _rebuild_lock_key(role):
+    return f"dashboard:{role}:rebuild"
+
+
+def catalog_page_params(role, args):
+    """Известные параметры страницы каталога в каноническом виде.
+
+    Из них строятся ключ кэша и ETag: посторонние параметры отбрасываются,
+    значения по умолчанию не отличаются от пропущенных.
+    """
+    config = current_app.config
+    limit, cursor = parse_page_args(args, config['PAGE_SIZE'], config['MAX_PAGE_SIZE'])
+    params = MultiDict()
+    if limit != config['PAGE_SIZE']:
+        params['limit'] = str(limit)
+    if cursor is not None:
+        params['cursor'] = str(cursor)
+    if role == 'admin':
+        available = parse_bool_arg(args.get('available'))
+        if available is not None:
+            params['available'] = 'true' if available else 'false'
+    for name in ('genre', 'author'):
+        if args.get(name):
+            params[name] = args[name]
+    if parse_bool_arg(args.get('with_ratings')):
+        params['with_ratings'] = 'true'
+    return params
+
+
+def query_catalog_page(role, args):
+    """Страница каталога с keyset-пагинацией по book_id и фильтрами"""
+    limit, cursor = parse_page_args(args, current_app.config['PAGE_SIZE'], current_app.config['MAX_PAGE_SIZE'])
+
+    query = Book.query
+    if role == 'admin':
+        available = parse_bool_arg(args.get('available'))
+        if available is True:
+            query = query.filter(Book.available_copies > 0)
+        elif available is False:
+            query = query.filter(Book.available_copies == 0)
+    else:
+        query = query.filter(Book.available_copies > 0)
+
+    genre = args.get('genre')
+    if genre:
+        query = query.filter(Book.genre == genre)
+    author = args.get('author')
+    if author:
+        query = query.filter(Book.author == author)
+
+    # Keyset-пагинация: следующая страница начинается после последнего book_id
+    if cursor is not None:
+        query = query.filter(Book.book_id > cursor)
+    books = query.order_by(Book.book_id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        next_cursor = books[-1].book_id
+
+    items = [book.to_dict() for book in books]
+    if parse_bool_arg(args.get('with_ratings')):
+        # Сводки оценок для всей страницы одним запросом к MongoDB
+        ratings = RatingSummary.get_many([item["book_id"] for item in items])
+        for item in items:
+            rating = ratings[item["book_id"]]
+            item["rating"] = {"count": rating["count"], "average": rating["average"]}
+
+    return {
+        "books": items,
+        "next_cursor": next_cursor
+    }
+
+
+def render_catalog_page(role, args):
+    """Готовое JSON-тело ответа для страницы каталога"""
+    return current_app.json.dumps(query_catalog_page(role, args)).encode('utf-8')
+
+
+def catalog_page_key(role, args, generation=None, ratings_version=None):
+    """Ключ кэша страницы; args — результат catalog_page_params.
+
+    Страницы с оценками устаревают и при новых отзывах, поэтому их ключ
+    дополнительно содержит версию сводок оценок.
+    """
+    name = f"dashboard_{role}_{sorted(args.items(multi=True))}"
+    if args.get('with_ratings'):
+        if ratings_version is None:
+            ratings_version = get_ratings_version()
+        name = f"{name}_r{ratings_version}"
+    return book_cache_key(name, generation)
+
+
+def get_catalog_page(role, args, generation=None, ratings_version=None):
+    """Страница каталога с фильтрами, общая для всех пользователей роли; args — результат catalog_page_params"""
+    key = catalog_page_key(role, args, generation, ratings_version)
+    body = get_raw(key)
+    if body is None:
+        body = render_catalog_page(role, args)
+        set_raw(key, body, current_app.config['CACHE_TIMEOUT'])
+    return body
+
+
+def rebuild_dashboard(role, generation=None):
+    """Пересборка предвычисленного ответа дашборда для роли"""
+    if generation is None:
+        generation = get_catalog_generation()
+    body = render_catalog_page(role, MultiDict())
+    set_raw(_payload_key(role), str(generation).encode() + b'\n' + body)
+    return generation, body
+
+
+def _split_payload(raw):
+    stored_generation, body = raw.split(b'\n', 1)
+    return int(stored_generation), body
+
+
+def get_dashboard_payload(role, generation=None):
+    """Предвычисленный ответ дашборда (первая страница без фильтров): (поколение, тело).
+
+    Если каталог изменился, читатели получают предыдущую версию, пока
+    один фоновый поток пересобирает новую.
+    """
+    raw = get_raw(_payload_key(role))
+    if raw is None:
+        return _rebuild_on_miss(role, generation)
+
+    stored_generation, body = _split_payload(raw)
+    if generation is None:
+        generation = get_catalog_generation()
+    if stored_generation < generation:
+        schedule_rebuild((role,))
+    return stored_generation, body
+
+
+def _rebuild_on_miss(role, generation):
+    """Ответа нет совсем (холодный старт, FLUSHDB, вытеснение).
+
+    Собирает его только владелец блокировки пересборки, остальные запросы
+    ждут появления ключа до DASHBOARD_REBUILD_WAIT секунд.
+    """
+    token = _acquire_rebuild_lock(role)
+    if token is not None:
+        try:
+            return rebuild_dashboard(role, generation)
+        finally:
+            release_lock(_rebuild_lock_key(role), token)
+
+    deadline = time.monotonic() + current_app.config.get('DASHBOARD_REBUILD_WAIT', 2.0)
+    while time.monotonic() < deadline:
+        time.sleep(_REBUILD_POLL_INTERVAL)
+        raw = get_raw(_payload_key(role))
+        if raw is not None:
+            return _split_payload(raw)
+
+    # Владелец блокировки не успел: отвечаем сами, не сохраняя результат
+    if generation is None:
+        generation = get_catalog_generation()
+    return generation, render_catalog_page(role, MultiDict())
+
+
+def dashboard_payload_key(role, generation):
+    """Ключ, от которого строятся ключи сжатых вариантов ответа дашборда"""
+    return f"{_payload_key(role)}:g{generation}"
+
+
+def _acquire_rebuild_lock(role):
+    """Блокировка пересборки дашборда роли; возвращает токен или None"""
+    token = uuid.uuid4().hex
+    lock_timeout = current_app.config.get('DASHBOARD_REBUILD_LOCK_TIMEOUT', 30)
+    if get_redis().set(_rebuild_lock_key(role), token, nx=True, ex=lock_timeout):
+        return token
+    return None
+
+
+def schedule_rebuild(roles=DASHBOARD_ROLES):
+    """Фоновая пересборка дашбордов; не более одной пересборки на роль"""
+    app = current_app._get_current_object()
+    for role in roles:
+        token = _acquire_rebuild_lock(role)
+        if token is not None:
+            threading.Thread(target=_rebuild_in_background, args=(app, role, token), daemon=True).start()
+
+
+def _rebuild_in_background(app, role, token):
+    with app.app_context():
+        try:
+            rebuild_dashboard(role)
+        except Exception:
+            app.logger.exception(f"Dashboard rebuild failed for role {role}")
+        finally:
+            release_lock(_rebuild_lock_key(role), token)
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+from flask import Response, current_app, request
+from .cache import get_raw, set_raw, get_cache_epoch
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаётся gzip
+    brotli = None
+
+
+def args_digest(args):
+    """Короткий отпечаток query-параметров для ключей кэша и ETag"""
+    return hashlib.sha1(repr(sorted(args.items(multi=True))).encode('utf-8')).hexdigest()[:16]
+
+
+def make_etag(*parts):
+    """ETag из эпохи кэша и версии данных (поколение каталога, версия отзывов), без хэширования тела"""
+    return '-'.join(str(part) for part in (get_cache_epoch(),) + parts)
+
+
+def negotiate_encoding():
+    """Лучшая поддерживаемая клиентом кодировка: br, gzip или None"""
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=current_app.config['RESPONSE_BROTLI_QUALITY'])
+    return gzip.compress(body, compresslevel=current_app.config['RESPONSE_GZIP_LEVEL'], mtime=0)
+
+
+def _tagged(etag, encoding):
+    # У каждого представления (identity, gzip, br) свой сильный ETag
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+def _finish(response, etag, cache_control, vary):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.update(vary)
+    return response
+
+
+def versioned_response(etag, load, cache_control='no-cache', vary=()):
+    """Ответ с ETag, If-None-Match → 304 и предварительно сжатым телом.
+
+    etag — версия, которую клиент получил бы сейчас: совпадение с
+    If-None-Match даёт 304 без обращения к БД и к кэшу. Иначе
+    load() -> (body, etag, cache_key) возвращает тело, его фактическую
+    версию (может отставать от текущей) и ключ, от которого строятся ключи
+    сжатых вариантов. Сжатые байты кэшируются, поэтому сжатие выполняется
+    один раз на версию, а не на каждый запрос.
+    """
+    vary = ('Accept-Encoding',) + tuple(vary)
+    encoding = negotiate_encoding()
+    for candidate in (_tagged(etag, encoding), etag):
+        if request.if_none_match.contains_weak(candidate):
+            return _finish(Response(status=304), candidate, cache_control, vary)
+
+    body, etag, cache_key = load()
+    compressible = encoding is not None and len(body) >= current_app.config['RESPONSE_COMPRESS_MIN_SIZE']
+    if not compressible:
+        encoding = None
+    # Загруженная версия может отставать от текущей (дашборд отдаёт прежний ответ,
+    # пока идёт пересборка) и совпасть с версией клиента
+    if request.if_none_match.contains_weak(_tagged(etag, encoding)):
+        return _finish(Response(status=304), _tagged(etag, encoding), cache_control, vary)
+
+    if encoding is None:
+        return _finish(Response(body, mimetype='application/json'), etag, cache_control, vary)
+
+    variant_key = f"{cache_key}:{encoding}"
+    data = get_raw(variant_key)
+    if data is None:
+        data = compress(body, encoding)
+        set_raw(variant_key, data, current_app.config['CACHE_TIMEOUT'])
+    response = Response(data, mimetype='application/json')
+    response.headers['Content-Encoding'] = encoding
+    return _finish(response, _tagged(etag, encoding), cache_control, vary)
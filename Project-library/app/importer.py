@@ -0,0 +1,187 @@
+import csv
+import io
+import json
+import time
+from sqlalchemy import func, select, update, delete
+from . import db
+from .models import Book, Rental
+from .models_mongo import LogEntry, BookReview, RatingSummary
+from .cache import clear_book_cache, bump_review_version, bump_ratings_version, bump_search_version
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORT_FIELDS = ('title', 'author', 'genre', 'total_copies')
+NATURAL_KEY_INDEX = 'uq_books_title_author'
+
+
+def iter_records(stream, fmt):
+    """Потоковое чтение записей из бинарного потока CSV или JSON Lines"""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        yield from csv.DictReader(text)
+    elif fmt == 'jsonl':
+        for line in text:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Некорректная строка пропускается на этапе normalize_record
+                yield None
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def normalize_record(record):
+    """Приведение записи к колонкам books; ValueError для некорректных строк"""
+    if not isinstance(record, dict):
+        raise ValueError("record is not a JSON object")
+    missing = [field for field in IMPORT_FIELDS if record.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+    try:
+        total_copies = int(record['total_copies'])
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid total_copies: {record['total_copies']!r}")
+    title = str(record['title']).strip()
+    author = str(record['author']).strip()
+    genre = str(record['genre']).strip()
+    if total_copies < 0:
+        raise ValueError("total_copies must be non-negative")
+    return {
+        "title": title,
+        "author": author,
+        "genre": genre,
+        "total_copies": total_copies,
+        "available_copies": total_copies
+    }
+
+
+def _upsert_statement():
+    """INSERT ... ON CONFLICT (title, author) DO UPDATE для текущего диалекта"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        greatest = func.greatest
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        greatest = func.max
+    else:
+        raise RuntimeError(f"Bulk import is not supported for {dialect}")
+
+    stmt = insert(Book)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=['title', 'author'],
+        set_={
+            'genre': excluded.genre,
+            'total_copies': excluded.total_copies,
+            # Выданные экземпляры остаются выданными при изменении тиража
+            'available_copies': greatest(
+                Book.available_copies + excluded.total_copies - Book.total_copies, 0
+            )
+        }
+    )
+
+
+def merge_duplicate_books():
+    """Слияние книг с одинаковыми (title, author) перед созданием уникального индекса.
+
+    Остаётся книга с наименьшим book_id: тиражи и свободные экземпляры
+    суммируются, аренды и отзывы переносятся на неё, сводки оценок
+    пересчитываются. Возвращает число удалённых дубликатов.
+    """
+    groups = db.session.execute(
+        select(Book.title, Book.author, func.min(Book.book_id),
+               func.sum(Book.total_copies), func.sum(Book.available_copies))
+        .group_by(Book.title, Book.author)
+        .having(func.count() > 1)
+    ).all()
+
+    merged = 0
+    for title, author, keep_id, total_copies, available_copies in groups:
+        duplicates = db.session.execute(
+            select(Book.book_id).where(Book.title == title, Book.author == author, Book.book_id != keep_id)
+        ).scalars().all()
+        # Отзывы переносятся первыми: при сбое до commit они уже указывают на оставшуюся книгу
+        BookReview.reassign(duplicates, keep_id)
+        db.session.execute(update(Rental).where(Rental.book_id.in_(duplicates)).values(book_id=keep_id))
+        db.session.execute(
+            update(Book).where(Book.book_id == keep_id)
+            .values(total_copies=total_copies, available_copies=available_copies)
+        )
+        db.session.execute(delete(Book).where(Book.book_id.in_(duplicates)))
+        db.session.commit()
+        for book_id in [keep_id] + duplicates:
+            RatingSummary.recompute(book_id)
+            # Страницы отзывов и их ETag версионируются по книге, а не по поколению каталога
+            bump_review_version(book_id)
+        merged += len(duplicates)
+
+    if merged:
+        bump_ratings_version()
+        bump_search_version()
+        clear_book_cache()
+    return merged
+
+
+def ensure_natural_key():
+    """Уникальный индекс по (title, author), на который опирается upsert импорта"""
+    for index in Book.__table__.indexes:
+        if index.name == NATURAL_KEY_INDEX:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+def _write_batch(rows, batch_number, user_id):
+    # Дубликаты ключа внутри одного INSERT недопустимы для ON CONFLICT: последняя запись побеждает
+    unique_rows = list({(row['title'], row['author']): row for row in rows}.values())
+    db.session.execute(_upsert_statement(), unique_rows)
+    db.session.commit()
+
+    LogEntry.create(
+        action="import_books",
+        user_id=user_id,
+        details={
+            "batch": batch_number,
+            "rows": len(unique_rows)
+        }
+    )
+    bump_search_version()
+    clear_book_cache()
+    return len(unique_rows)
+
+
+def import_books(stream, fmt, user_id=None, batch_size=5000, progress=None, max_errors=20):
+    """Потоковый импорт каталога пакетами с upsert по (title, author).
+
+    Кэш инвалидируется и журнал пишется один раз на пакет. progress
+    вызывается после каждого пакета со сводкой на текущий момент.
+    """
+    summary = {"rows": 0, "upserted": 0, "batches": 0, "skipped": 0, "errors": []}
+    started = time.perf_counter()
+    batch = []
+
+    def flush():
+        summary["batches"] += 1
+        summary["upserted"] += _write_batch(batch, summary["batches"], user_id)
+        batch.clear()
+        summary["elapsed"] = round(time.perf_counter() - started, 3)
+        if progress:
+            progress(summary)
+
+    for line_number, record in enumerate(iter_records(stream, fmt), start=1):
+        summary["rows"] += 1
+        try:
+            batch.append(normalize_record(record))
+        except ValueError as e:
+            summary["skipped"] += 1
+            if len(summary["errors"]) < max_errors:
+                summary["errors"].append({"record": line_number, "error": str(e)})
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    summary["elapsed"] = round(time.perf_counter() - started, 3)
+    return summary
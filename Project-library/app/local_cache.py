@@ -0,0 +1,261 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask_caching.backends.rediscache import RedisCache
+from redis.exceptions import RedisError
+
+
+class LocalCache:
+    """In-process кэш (L1) перед Redis: LRU-вытеснение, TTL записей, лимит памяти.
+
+    Хранит сырые байты, полученные из Redis. Инвалидация доходит до всех
+    воркеров через Redis pub/sub: каждый процесс подписан на канал
+    CACHE_INVALIDATION_CHANNEL и удаляет у себя указанные ключи.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.max_entries = 1024
+        self.max_bytes = 64 * 1024 * 1024
+        self.ttl = 30
+        self.channel = 'cache:invalidate'
+
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._listener = None
+        self._pid = None
+        self._reset_counters()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('L1_CACHE_ENABLED', False)
+        self.max_entries = app.config.get('L1_CACHE_MAX_ENTRIES', 1024)
+        self.max_bytes = app.config.get('L1_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+        self.ttl = app.config.get('L1_CACHE_TTL', 30)
+        self.channel = app.config.get('CACHE_INVALIDATION_CHANNEL', 'cache:invalidate')
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def epoch(self):
+        """Номер поколения инвалидаций: значение из Redis, прочитанное до
+        инвалидации, не должно попасть в L1 после неё"""
+        return self._epoch
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        self._ensure_listener()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, epoch=None):
+        if not self.enabled or value is None:
+            return
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, value = self._data.pop(key)
+        self._bytes -= len(key) + len(value)
+
+    def discard(self, *keys):
+        """Удаление ключей только в текущем процессе"""
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                if key in self._data:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self._bytes = 0
+
+    def invalidate(self, *keys):
+        """Удаление ключей во всех воркерах (локально и через pub/sub)"""
+        if not self.enabled:
+            return
+        self.discard(*keys)
+        self._publish({"keys": list(keys)})
+
+    def invalidate_all(self):
+        if not self.enabled:
+            return
+        self.clear()
+        self._publish({"all": True})
+
+    def _publish(self, message):
+        from .cache import get_redis
+
+        message["pid"] = os.getpid()
+        try:
+            get_redis().publish(self.channel, json.dumps(message))
+        except RedisError:
+            # Без доставки сообщения устаревшая запись проживёт не дольше L1_CACHE_TTL
+            pass
+
+    def _ensure_listener(self):
+        # После fork поток-подписчик родителя в дочернем процессе не работает
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._data.clear()
+            self._bytes = 0
+            self._reset_counters()
+            self._listener = threading.Thread(target=self._listen, name='l1-cache-invalidation', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        from .cache import get_redis
+
+        while True:
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Сообщения, пропущенные без подписки, не восстановить: начинаем с пустого L1
+                self.clear()
+                while True:
+                    # Опрос с таймаутом вместо listen(): блокирующее чтение упиралось бы
+                    # в REDIS_SOCKET_TIMEOUT и приводило к переподключению и сбросу L1
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self._handle(message)
+            except RedisError:
+                time.sleep(1)
+
+    def _handle(self, message):
+        if message.get('type') != 'message':
+            return
+        try:
+            payload = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if payload.get('pid') == os.getpid():
+            return
+        if payload.get('all'):
+            self.clear()
+        else:
+            self.discard(*payload.get('keys', []))
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+
+class TwoTierRedisCache(RedisCache):
+    """Бэкенд Flask-Caching: L1 в процессе перед RedisCache"""
+
+    def get(self, key):
+        from . import l1_cache
+        from .cache import record_redis_lookup
+
+        full_key = self._get_prefix() + key
+        raw = l1_cache.get(full_key)
+        if raw is None:
+            epoch = l1_cache.epoch
+            raw = self._read_client.get(full_key)
+            record_redis_lookup(raw is not None)
+            if raw is None:
+                return None
+            l1_cache.set(full_key, raw, epoch=epoch)
+        return self.serializer.loads(raw)
+
+    def _invalidate(self, *keys):
+        from . import l1_cache
+
+        l1_cache.invalidate(*[self._get_prefix() + key for key in keys])
+
+    def set(self, key, value, timeout=None):
+        result = super().set(key, value, timeout)
+        self._invalidate(key)
+        return result
+
+    def add(self, key, value, timeout=None):
+        result = super().add(key, value, timeout)
+        self._invalidate(key)
+        return result
+
+    def set_many(self, mapping, timeout=None):
+        result = super().set_many(mapping, timeout)
+        self._invalidate(*mapping)
+        return result
+
+    def delete(self, key):
+        result = super().delete(key)
+        self._invalidate(key)
+        return result
+
+    def delete_many(self, *keys):
+        result = super().delete_many(*keys)
+        self._invalidate(*keys)
+        return result
+
+    def unlink(self, *keys):
+        result = super().unlink(*keys)
+        self._invalidate(*keys)
+        return result
+
+    def inc(self, key, delta=1):
+        result = super().inc(key, delta)
+        self._invalidate(key)
+        return result
+
+    def dec(self, key, delta=1):
+        result = super().dec(key, delta)
+        self._invalidate(key)
+        return result
+
+    def clear(self):
+        from . import l1_cache
+
+        result = super().clear()
+        l1_cache.invalidate_all()
+        return result
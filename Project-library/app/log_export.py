@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import current_app
+from .models_mongo import LogEntry, JobCheckpoint
+
+
+def parse_time(value):
+    """Граница диапазона в ISO 8601; ValueError для некорректного значения.
+
+    Время с часовым поясом (например, ...Z) переводится в UTC без пояса:
+    так хранятся timestamp логов и сравниваются границы периодов.
+    """
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    except (TypeError, OverflowError):
+        raise ValueError(f"Invalid time: {value}")
+    return parsed
+
+
+def resume_token(entry):
+    """Токен продолжения: timestamp и _id последней выгруженной записи"""
+    return f"{entry['timestamp'].isoformat()}|{entry['_id']}"
+
+
+def parse_resume_token(token):
+    """Разбор токена продолжения; ValueError для некорректного значения"""
+    try:
+        timestamp, entry_id = token.split('|')
+        return parse_time(timestamp), ObjectId(entry_id)
+    except (ValueError, InvalidId):
+        raise ValueError(f"Invalid resume token: {token}")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def to_ndjson(entry):
+    """Запись лога одной строкой JSON; timestamp в ISO 8601 совпадает с форматом токена"""
+    return json.dumps(entry, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def export_chunks(start=None, end=None, actions=None, after=None, compress=False,
+                  batch_size=None, chunk_size=None):
+    """Генератор блоков выгрузки: (bytes, число записей, токен продолжения).
+
+    Записи читаются курсором по возрастанию (timestamp, _id), в памяти
+    держится только текущий блок из chunk_size строк. При compress каждый
+    блок — отдельный gzip-член: их конкатенация остаётся корректным
+    gzip-файлом, а оборванную выгрузку можно обрезать до границы блока
+    и продолжить.
+    """
+    config = current_app.config
+    batch_size = batch_size or config['LOG_EXPORT_BATCH_SIZE']
+    chunk_size = chunk_size or config['LOG_EXPORT_CHUNK_SIZE']
+
+    lines = []
+    last = None
+    for entry in LogEntry.iter_range(start, end, actions, after, batch_size):
+        lines.append(to_ndjson(entry))
+        last = entry
+        if len(lines) >= chunk_size:
+            yield _pack(lines, compress), len(lines), resume_token(last)
+            lines = []
+    if lines:
+        yield _pack(lines, compress), len(lines), resume_token(last)
+
+
+def _pack(lines, compress):
+    data = b''.join(lines)
+    if compress:
+        return gzip.compress(data, compresslevel=current_app.config['RESPONSE_GZIP_LEVEL'], mtime=0)
+    return data
+
+
+def export_logs(path, start=None, end=None, actions=None, compress=False,
+                batch_size=None, resume=True, progress=None):
+    """Выгрузка логов в файл NDJSON (или NDJSON.gz) с продолжением после сбоя.
+
+    После каждого записанного блока в job_checkpoints сохраняются токен
+    продолжения и длина файла. Повторный запуск с теми же параметрами
+    обрезает файл до последнего сохранённого блока и продолжает с него.
+    progress вызывается после каждого блока со сводкой.
+    """
+    job_id = f"export-logs:{os.path.abspath(path)}"
+    params = {
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "actions": sorted(actions) if actions else None,
+        "compress": bool(compress)
+    }
+    checkpoint = JobCheckpoint.get(job_id) if resume else None
+    if checkpoint is None:
+        JobCheckpoint.delete(job_id)
+    elif checkpoint.get("params") != params:
+        raise ValueError("Checkpoint was created with different export parameters; use --restart")
+    elif checkpoint.get("finished"):
+        return dict(checkpoint.get("summary", {}), already_finished=True)
+
+    offset = checkpoint["bytes"] if checkpoint else 0
+    if offset and (not os.path.exists(path) or os.path.getsize(path) < offset):
+        raise ValueError(f"{path} is shorter than the checkpoint; use --restart")
+
+    summary = {
+        "path": path,
+        "rows": checkpoint.get("rows", 0) if checkpoint else 0,
+        "bytes": offset,
+        "resumed_from": checkpoint.get("after") if checkpoint else None,
+        "chunks": 0,
+        "elapsed": 0.0,
+        "rows_per_sec": 0.0
+    }
+    after = parse_resume_token(checkpoint["after"]) if checkpoint else None
+    started = time.perf_counter()
+    exported = 0
+
+    with open(path, 'r+b' if offset else 'wb') as f:
+        # Хвост после последнего сохранённого блока записан не полностью
+        f.truncate(offset)
+        f.seek(offset)
+        for data, count, token in export_chunks(start, end, actions, after, compress, batch_size):
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            exported += count
+            summary["rows"] += count
+            summary["bytes"] = f.tell()
+            summary["chunks"] += 1
+            JobCheckpoint.save(job_id, params=params, after=token, bytes=summary["bytes"], rows=summary["rows"])
+
+            summary["elapsed"] = round(time.perf_counter() - started, 3)
+            summary["rows_per_sec"] = round(exported / summary["elapsed"], 1) if summary["elapsed"] else 0.0
+            if progress is not None:
+                progress(summary)
+
+    summary["elapsed"] = round(time.perf_counter() - started, 3)
+    summary["rows_per_sec"] = round(exported / summary["elapsed"], 1) if summary["elapsed"] else 0.0
+    JobCheckpoint.save(job_id, params=params, finished=True, summary=summary)
+    return summary
@@ -0,0 +1,274 @@
+import atexit
+import glob
+import os
+import queue
+import threading
+import time
+
+from bson import json_util
+from pymongo.errors import PyMongoError, BulkWriteError
+
+
+OVERFLOW_POLICIES = ('drop', 'block', 'spill')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LogWriter:
+    """Буферизированная фоновая запись логов в MongoDB.
+
+    Записи складываются в ограниченную очередь и сбрасываются фоновым
+    потоком через insert_many при достижении LOG_BATCH_SIZE или по
+    истечении LOG_FLUSH_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.max_queue_size = 10000
+        self.overflow_policy = 'drop'
+        self.block_timeout = 1.0
+        self.spill_path = None
+
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset_counters()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('LOG_WRITER_ENABLED', True)
+        self.batch_size = app.config.get('LOG_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('LOG_FLUSH_INTERVAL', 1.0)
+        self.max_queue_size = app.config.get('LOG_QUEUE_SIZE', 10000)
+        self.overflow_policy = app.config.get('LOG_OVERFLOW_POLICY', 'drop')
+        self.block_timeout = app.config.get('LOG_BLOCK_TIMEOUT', 1.0)
+        self.spill_path = app.config.get('LOG_SPILL_PATH')
+
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown LOG_OVERFLOW_POLICY: {self.overflow_policy}")
+        if self.overflow_policy == 'spill' and not self.spill_path:
+            raise ValueError("LOG_SPILL_PATH is required for the 'spill' overflow policy")
+
+        atexit.register(self.close)
+
+    def _reset_counters(self):
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def _ensure_started(self):
+        # После fork поток и очередь родителя недоступны: создаём заново
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._stop = threading.Event()
+            self._reset_counters()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, entry):
+        """Постановка записи в очередь на запись"""
+        self._ensure_started()
+        try:
+            if self.overflow_policy == 'block':
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+            self.enqueued += 1
+        except queue.Full:
+            if self.overflow_policy == 'spill':
+                self._spill([entry])
+            else:
+                self.dropped += 1
+
+    def submit_many(self, entries):
+        for entry in entries:
+            self.submit(entry)
+
+    def _run(self):
+        if self.spill_path:
+            self._replay_orphans()
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            # Spill-файл дописывается, как только MongoDB снова принимает записи, даже под нагрузкой
+            if (not batch or self._flush(batch)) and self.spill_path:
+                self._replay_spill()
+        self._drain()
+
+    def _collect_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            if self._stop.is_set():
+                break
+        return batch
+
+    def _drain(self):
+        """Синхронный сброс всего, что осталось в очереди"""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _insert(self, batch):
+        from . import mongo
+        try:
+            mongo.db.logs.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Дубликаты _id возможны при повторной записи из spill-файла
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+            if errors:
+                raise
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            self._insert(batch)
+        except PyMongoError:
+            self.failed_flushes += 1
+            if self.overflow_policy == 'spill':
+                self._spill(batch)
+            else:
+                self.dropped += len(batch)
+            return False
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed
+            self.total_flush_ms += elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        self.written += len(batch)
+        return True
+
+    def _spill_file(self):
+        return f"{self.spill_path}.{os.getpid()}"
+
+    def _spill(self, entries):
+        """Сохранение записей на диск (JSON Lines) для последующей дозаписи"""
+        with self._lock:
+            with open(self._spill_file(), 'a', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json_util.dumps(entry) + '\n')
+        self.spilled += len(entries)
+
+    def _replay_path(self):
+        return f"{self._spill_file()}.replay"
+
+    def _replay_spill(self):
+        path = self._spill_file()
+        if not os.path.exists(path):
+            return
+        with self._lock:
+            os.replace(path, self._replay_path())
+        self._replay_file(self._replay_path())
+
+    def _replay_orphans(self):
+        """Дозапись spill-файлов завершившихся процессов (перезапуск воркера, остановка без MongoDB).
+
+        Файл забирается атомарным переименованием в replay-файл этого
+        процесса: если его уже забрал другой воркер, rename не находит файл.
+        """
+        prefix = f"{self.spill_path}."
+        for path in glob.glob(glob.escape(self.spill_path) + '.*'):
+            pid = path[len(prefix):].split('.', 1)[0]
+            if not pid.isdigit() or int(pid) == os.getpid() or _pid_alive(int(pid)):
+                continue
+            try:
+                os.rename(path, self._replay_path())
+            except FileNotFoundError:
+                continue
+            self._replay_file(self._replay_path())
+
+    def _replay_file(self, replay_path):
+        with open(replay_path, encoding='utf-8') as f:
+            batch = []
+            for line in f:
+                batch.append(json_util.loads(line))
+                if len(batch) >= self.batch_size:
+                    if not self._replay_batch(batch):
+                        self._spill_lines(f)
+                        break
+                    batch = []
+            else:
+                if batch and not self._replay_batch(batch):
+                    self._spill_lines(f)
+        os.remove(replay_path)
+
+    def _spill_lines(self, lines):
+        with self._lock:
+            with open(self._spill_file(), 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+
+    def _replay_batch(self, batch):
+        try:
+            self._insert(batch)
+        except PyMongoError:
+            # MongoDB всё ещё недоступна: возвращаем остаток в spill-файл
+            self._spill(batch)
+            return False
+        self.replayed += len(batch)
+        return True
+
+    def close(self, timeout=10.0):
+        """Остановка фонового потока со сбросом очереди"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self.spill_path and not self._thread.is_alive():
+            # Если MongoDB недоступна, записи остаются в spill-файле и их дозапишет следующий процесс
+            self._replay_spill()
+        self._thread = None
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_queue_size,
+            "overflow_policy": self.overflow_policy,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0
+        }
@@ -1,6 +1,7 @@
 from . import db
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import update, select
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -22,6 +23,53 @@ class Book(db.Model):
     available_copies = db.Column(db.Integer, nullable=False)
     total_copies = db.Column(db.Integer, nullable=False)
 
+    # Натуральный ключ для upsert при импорте и индексы под keyset-пагинацию с фильтрами
+    __table_args__ = (
+        # Уникальный индекс, а не ограничение: ensure_sql_schema досоздаёт его в существующих таблицах
+        db.Index('uq_books_title_author', 'title', 'author', unique=True),
+        db.Index('ix_books_genre_book_id', 'genre', 'book_id'),
+        db.Index('ix_books_author_book_id', 'author', 'book_id'),
+        db.Index('ix_books_available_book_id', 'book_id',
+                 postgresql_where=db.text('available_copies > 0'),
+                 sqlite_where=db.text('available_copies > 0')),
+    )
+
+    def to_dict(self):
+        return {
+            "book_id": self.book_id,
+            "title": self.title,
+            "author": self.author,
+            "genre": self.genre,
+            "available_copies": self.available_copies,
+            "total_copies": self.total_copies
+        }
+
+    @classmethod
+    def checkout(cls, book_id):
+        """Атомарное списание экземпляра.
+
+        Одно условное UPDATE ... RETURNING: уменьшает available_copies только
+        пока оно больше нуля. Возвращает (available_copies, title, author) или None.
+        """
+        return db.session.execute(
+            update(cls)
+            .where(cls.book_id == book_id, cls.available_copies > 0)
+            .values(available_copies=cls.available_copies - 1)
+            .returning(cls.available_copies, cls.title, cls.author)
+            .execution_options(synchronize_session=False)
+        ).first()
+
+    @classmethod
+    def checkin(cls, book_id):
+        """Атомарный возврат экземпляра (не больше total_copies)"""
+        return db.session.execute(
+            update(cls)
+            .where(cls.book_id == book_id, cls.available_copies < cls.total_copies)
+            .values(available_copies=cls.available_copies + 1)
+            .returning(cls.available_copies, cls.title)
+            .execution_options(synchronize_session=False)
+        ).first()
+
 class Rental(db.Model):
     __tablename__ = 'rentals'
     rental_id = db.Column(db.Integer, primary_key=True)
@@ -29,9 +77,87 @@ class Rental(db.Model):
     book_id = db.Column(db.Integer, db.ForeignKey('books.book_id'), nullable=False)
     rental_date = db.Column(db.Date, default=datetime.utcnow, nullable=False)
     return_date = db.Column(db.Date, nullable=True)
+    due_date = db.Column(db.Date, nullable=True)
 
     user = db.relationship("User", back_populates="rentals")
     book = db.relationship("Book", back_populates="rentals")
 
+    # Частичные индексы по открытым арендам (return_date IS NULL): возврат и
+    # выборки по книге не сканируют растущую историю закрытых аренд
+    __table_args__ = (
+        db.Index('ix_rentals_open_user_book', 'user_id', 'book_id', 'rental_id',
+                 postgresql_where=db.text('return_date IS NULL'),
+                 sqlite_where=db.text('return_date IS NULL')),
+        db.Index('ix_rentals_open_book', 'book_id',
+                 postgresql_where=db.text('return_date IS NULL'),
+                 sqlite_where=db.text('return_date IS NULL')),
+        db.Index('ix_rentals_open_user_rental', 'user_id', 'rental_id',
+                 postgresql_where=db.text('return_date IS NULL'),
+                 sqlite_where=db.text('return_date IS NULL')),
+        # Потоковый обход открытых аренд по rental_id при поиске просроченных
+        db.Index('ix_rentals_open_rental_due', 'rental_id', 'due_date',
+                 postgresql_where=db.text('return_date IS NULL'),
+                 sqlite_where=db.text('return_date IS NULL')),
+        # История аренд пользователя с keyset-пагинацией по rental_id
+        db.Index('ix_rentals_user_rental', 'user_id', 'rental_id'),
+    )
+
+    def to_dict(self):
+        return {
+            "rental_id": self.rental_id,
+            "book_id": self.book_id,
+            "rental_date": self.rental_date.isoformat() if self.rental_date else None,
+            "return_date": self.return_date.isoformat() if self.return_date else None,
+            "due_date": self.due_date.isoformat() if self.due_date else None
+        }
+
+    @classmethod
+    def close_open(cls, user_id, book_id, return_date):
+        """Атомарное закрытие открытой аренды пользователя.
+
+        Условие return_date IS NULL в UPDATE не даёт двум параллельным
+        возвратам закрыть одну и ту же аренду. Возвращает
+        (rental_id, rental_date, return_date) или None.
+        """
+        open_rental_id = (
+            select(cls.rental_id)
+            .where(cls.user_id == user_id, cls.book_id == book_id, cls.return_date.is_(None))
+            .order_by(cls.rental_id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        return db.session.execute(
+            update(cls)
+            .where(cls.rental_id == open_rental_id, cls.return_date.is_(None))
+            .values(return_date=return_date)
+            .returning(cls.rental_id, cls.rental_date, cls.return_date)
+            .execution_options(synchronize_session=False)
+        ).first()
+
+    @classmethod
+    def user_history(cls, user_id, status=None, limit=50, cursor=None):
+        """История аренд пользователя от новых к старым: keyset-пагинация по rental_id.
+
+        status: 'open', 'closed' или None (все). Возвращает (список (аренда, название книги), next_cursor).
+        """
+        query = (
+            select(cls, Book.title)
+            .join(Book, Book.book_id == cls.book_id)
+            .where(cls.user_id == user_id)
+        )
+        if status == 'open':
+            query = query.where(cls.return_date.is_(None))
+        elif status == 'closed':
+            query = query.where(cls.return_date.is_not(None))
+        if cursor is not None:
+            query = query.where(cls.rental_id < cursor)
+        rows = db.session.execute(query.order_by(cls.rental_id.desc()).limit(limit + 1)).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0].rental_id
+        return rows, next_cursor
+
 User.rentals = db.relationship("Rental", order_by=Rental.rental_id, back_populates="user")
 Book.rentals = db.relationship("Rental", order_by=Rental.rental_id, back_populates="book")
@@ -1,22 +1,125 @@
-from datetime import datetime
+import base64
+from datetime import datetime, timedelta
 from bson import ObjectId
-from . import mongo
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
+from . import mongo, log_writer
+
+# Коды ошибок MongoDB: индекс с тем же именем/ключом, но другими параметрами
+INDEX_OPTIONS_CONFLICT = (85, 86)
+
+
+def ensure_indexes(retention=None, retention_days=None, capped_size_mb=None):
+    """Идемпотентное создание индексов и политики хранения логов.
+
+    retention: None (хранить всё), 'ttl' (удаление записей старше
+    retention_days) или 'capped' (ограниченная коллекция capped_size_mb).
+    RuntimeError, если существующую коллекцию logs нужно преобразовать в
+    ограниченную вручную; остальные индексы к этому моменту уже созданы.
+    """
+    db = mongo.db
+
+    capped_error = None
+    if retention == 'capped':
+        try:
+            _ensure_capped_logs(db, capped_size_mb)
+        except RuntimeError as e:
+            # Остальные индексы создаются и без преобразования коллекции
+            capped_error = e
+
+    db.logs.create_index([("user_id", ASCENDING), ("timestamp", DESCENDING)], name="user_id_timestamp")
+    db.logs.create_index([("book_id", ASCENDING), ("timestamp", DESCENDING)], name="book_id_timestamp")
+    db.logs.create_index([("action", ASCENDING), ("timestamp", DESCENDING)], name="action_timestamp")
+
+    if retention == 'ttl':
+        _ensure_logs_ttl(db, int(retention_days * 24 * 3600))
+    else:
+        db.logs.create_index([("timestamp", DESCENDING)], name="timestamp")
+        # TTL-индекс прежней политики продолжал бы удалять записи
+        if "timestamp_ttl" in db.logs.index_information():
+            db.logs.drop_index("timestamp_ttl")
+    # Порядок выгрузки логов: (timestamp, _id) без сортировки в памяти сервера
+    db.logs.create_index([("timestamp", ASCENDING), ("_id", ASCENDING)], name="timestamp_id")
+
+    db.book_reviews.create_index([("book_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                                 name="book_id_created_at_id")
+    db.book_reviews.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at")
+
+    db.notifications.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at")
+
+    db.activity_rollups.create_index([("granularity", ASCENDING), ("dimension", ASCENDING), ("bucket", ASCENDING)],
+                                     name="granularity_dimension_bucket")
+    db.activity_rollups.create_index([("dimension", ASCENDING), ("key", ASCENDING),
+                                      ("granularity", ASCENDING), ("bucket", ASCENDING)],
+                                     name="dimension_key_granularity_bucket")
+    # Пересчёт корзины свёрткой: все счётчики одной корзины
+    db.activity_rollups.create_index([("granularity", ASCENDING), ("bucket", ASCENDING)], name="granularity_bucket")
+
+    if capped_error is not None:
+        raise capped_error
+
+
+def _ensure_logs_ttl(db, expire_after_seconds):
+    try:
+        db.logs.create_index([("timestamp", ASCENDING)], name="timestamp_ttl",
+                             expireAfterSeconds=expire_after_seconds)
+    except OperationFailure as e:
+        if e.code not in INDEX_OPTIONS_CONFLICT:
+            raise
+        # Срок хранения изменился: обновляем существующий TTL-индекс без пересоздания
+        db.command('collMod', 'logs', index={
+            'name': 'timestamp_ttl',
+            'expireAfterSeconds': expire_after_seconds
+        })
+
+
+def _ensure_capped_logs(db, size_mb):
+    size = int(size_mb * 1024 * 1024)
+    if 'logs' not in db.list_collection_names():
+        db.create_collection('logs', capped=True, size=size)
+        return
+    if not db.logs.options().get('capped'):
+        # convertToCapped блокирует коллекцию, поэтому выполняется только вручную
+        raise RuntimeError(
+            "Collection 'logs' already exists and is not capped; "
+            f"run db.runCommand({{convertToCapped: 'logs', size: {size}}}) manually"
+        )
 
 
 class LogEntry:
     @staticmethod
-    def create(action, user_id=None, book_id=None, details=None):
-        """Создание записи лога в MongoDB"""
-        entry = {
+    def build(action, user_id=None, book_id=None, details=None):
+        """Формирование документа записи лога"""
+        return {
             "action": action,
             "timestamp": datetime.utcnow(),
             "user_id": user_id,
             "book_id": book_id,
             "details": details or {}
         }
-        mongo.db.logs.insert_one(entry)
+
+    @staticmethod
+    def create(action, user_id=None, book_id=None, details=None):
+        """Создание записи лога в MongoDB"""
+        entry = LogEntry.build(action, user_id, book_id, details)
+        if log_writer.enabled:
+            log_writer.submit(entry)
+        else:
+            mongo.db.logs.insert_one(entry)
         return entry
 
+    @staticmethod
+    def create_many(entries):
+        """Пакетное создание записей лога (документы из LogEntry.build)"""
+        if not entries:
+            return entries
+        if log_writer.enabled:
+            log_writer.submit_many(entries)
+        else:
+            mongo.db.logs.insert_many(entries, ordered=False)
+        return entries
+
     @staticmethod
     def get_user_activity(user_id, limit=50):
         """Получение активности пользователя"""
@@ -35,6 +138,56 @@ class LogEntry:
         cursor = mongo.db.logs.find(query).sort("timestamp", -1).limit(limit)
         return list(cursor)
 
+    @staticmethod
+    def iter_range(start=None, end=None, actions=None, after=None, batch_size=1000):
+        """Потоковый обход логов по возрастанию (timestamp, _id).
+
+        Документы приходят с сервера порциями по batch_size и не копятся
+        в памяти. after — (timestamp, _id) последней полученной записи:
+        обход продолжается строго после неё.
+        """
+        query = {}
+        if start is not None or end is not None:
+            query["timestamp"] = {}
+            if start is not None:
+                query["timestamp"]["$gte"] = start
+            if end is not None:
+                query["timestamp"]["$lt"] = end
+        if actions:
+            query["action"] = {"$in": list(actions)}
+        if after is not None:
+            timestamp, entry_id = after
+            query["$or"] = [
+                {"timestamp": {"$gt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$gt": entry_id}}
+            ]
+        # Выгрузка может идти дольше таймаута простоя курсора (медленный клиент)
+        cursor = mongo.db.logs.find(query, no_cursor_timeout=True) \
+            .sort([("timestamp", ASCENDING), ("_id", ASCENDING)]) \
+            .batch_size(batch_size)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+
+REVIEW_FIELDS = ('user_id', 'book_id', 'rating', 'review_text', 'created_at', 'updated_at')
+
+
+def encode_review_cursor(created_at, review_id):
+    """Непрозрачный курсор страницы отзывов: (created_at, _id)"""
+    raw = f"{created_at.isoformat()}|{review_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_review_cursor(cursor):
+    """Разбор курсора; ValueError для некорректного значения"""
+    try:
+        created_at, review_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), ObjectId(review_id)
+    except (ValueError, InvalidId, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
 
 class BookReview:
     @staticmethod
@@ -50,16 +203,273 @@ class BookReview:
         }
         result = mongo.db.book_reviews.insert_one(review)
         review["_id"] = result.inserted_id
+        RatingSummary.add(book_id, rating)
         return review
 
     @staticmethod
-    def get_book_reviews(book_id):
-        """Получение всех отзывов о книге"""
-        cursor = mongo.db.book_reviews.find({"book_id": book_id}).sort("created_at", -1)
-        return list(cursor)
+    def get_book_reviews(book_id, limit=20, cursor=None, fields=None, ascending=False):
+        """Страница отзывов о книге с курсорной пагинацией по (created_at, _id).
+
+        Возвращает (отзывы, next_cursor). fields — проекция из REVIEW_FIELDS,
+        _id и created_at возвращаются всегда.
+        """
+        direction = ASCENDING if ascending else DESCENDING
+        query = {"book_id": book_id}
+        if cursor is not None:
+            created_at, review_id = decode_review_cursor(cursor)
+            op = "$gt" if ascending else "$lt"
+            query["$or"] = [
+                {"created_at": {op: created_at}},
+                {"created_at": created_at, "_id": {op: review_id}}
+            ]
+
+        projection = None
+        if fields:
+            projection = {field: 1 for field in fields}
+            projection["created_at"] = 1
+
+        docs = list(
+            mongo.db.book_reviews.find(query, projection)
+            .sort([("created_at", direction), ("_id", direction)])
+            .limit(limit + 1)
+        )
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_review_cursor(docs[-1]["created_at"], docs[-1]["_id"])
+        for doc in docs:
+            doc["_id"] = str(doc["_id"])
+        return docs, next_cursor
+
+    @staticmethod
+    def reassign(book_ids, target_book_id):
+        """Перенос отзывов удалённых книг-дубликатов на оставшуюся книгу"""
+        return mongo.db.book_reviews.update_many(
+            {"book_id": {"$in": list(book_ids)}},
+            {"$set": {"book_id": target_book_id}}
+        ).modified_count
 
     @staticmethod
     def get_user_reviews(user_id):
         """Получение всех отзывов пользователя"""
         cursor = mongo.db.book_reviews.find({"user_id": user_id}).sort("created_at", -1)
-        return list(cursor)
\ No newline at end of file
+        return list(cursor)
+
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+
+class RatingSummary:
+    """Инкрементальная сводка оценок по книге: count, sum и гистограмма"""
+
+    @staticmethod
+    def add(book_id, rating):
+        """Атомарный учёт новой оценки"""
+        mongo.db.book_ratings.update_one(
+            {"_id": book_id},
+            {"$inc": {"count": 1, "sum": rating, f"histogram.{rating}": 1}},
+            upsert=True
+        )
+
+    @staticmethod
+    def _format(book_id, doc):
+        doc = doc or {}
+        count = doc.get("count", 0)
+        total = doc.get("sum", 0)
+        histogram = doc.get("histogram", {})
+        return {
+            "book_id": book_id,
+            "count": count,
+            "average": round(total / count, 2) if count else None,
+            "histogram": {str(value): histogram.get(str(value), 0) for value in RATING_VALUES}
+        }
+
+    @staticmethod
+    def get(book_id):
+        """Сводка оценок книги"""
+        return RatingSummary._format(book_id, mongo.db.book_ratings.find_one({"_id": book_id}))
+
+    @staticmethod
+    def get_many(book_ids):
+        """Сводки для списка книг одним запросом: {book_id: сводка}"""
+        docs = {doc["_id"]: doc for doc in mongo.db.book_ratings.find({"_id": {"$in": list(book_ids)}})}
+        return {book_id: RatingSummary._format(book_id, docs.get(book_id)) for book_id in book_ids}
+
+    @staticmethod
+    def recompute(book_id=None):
+        """Полный пересчёт сводок по book_reviews (для восстановления)"""
+        pipeline = []
+        if book_id is not None:
+            pipeline.append({"$match": {"book_id": book_id}})
+        pipeline.append({"$group": {
+            "_id": {"book_id": "$book_id", "rating": "$rating"},
+            "count": {"$sum": 1}
+        }})
+
+        summaries = {}
+        for row in mongo.db.book_reviews.aggregate(pipeline):
+            summary = summaries.setdefault(row["_id"]["book_id"], {"count": 0, "sum": 0, "histogram": {}})
+            rating = row["_id"]["rating"]
+            summary["count"] += row["count"]
+            summary["sum"] += rating * row["count"]
+            summary["histogram"][str(rating)] = row["count"]
+
+        if book_id is None:
+            mongo.db.book_ratings.delete_many({"_id": {"$nin": list(summaries)}})
+        elif not summaries:
+            mongo.db.book_ratings.delete_one({"_id": book_id})
+        for summary_book_id, summary in summaries.items():
+            mongo.db.book_ratings.replace_one({"_id": summary_book_id}, summary, upsert=True)
+        return len(summaries)
+
+
+class Notification:
+    @staticmethod
+    def create_many(notifications):
+        """Пакетная запись уведомлений; документы с уже существующим _id пропускаются.
+
+        Детерминированные _id делают повторный запуск задания идемпотентным.
+        Возвращает число новых документов.
+        """
+        if not notifications:
+            return 0
+        try:
+            return len(mongo.db.notifications.insert_many(notifications, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+            if errors:
+                raise
+            return e.details.get('nInserted', 0)
+
+
+class ActivityRollup:
+    """Счётчики активности по часам и дням (коллекция activity_rollups).
+
+    Документ — число записей лога с действием action в корзине bucket
+    для значения key измерения dimension: 'action' (key — само действие),
+    'book' (book_id) или 'genre'.
+    """
+
+    @staticmethod
+    def replace_bucket(granularity, bucket, counts):
+        """Замена счётчиков корзины пересчитанными {(dimension, key, action): n}.
+
+        Значения записываются через $set, счётчики, которых больше нет,
+        удаляются: повторный вызов с теми же данными ничего не меняет.
+        """
+        now = datetime.utcnow()
+        ids = []
+        requests = []
+        for (dimension, key, action), count in counts.items():
+            doc_id = f"{granularity}|{bucket:%Y%m%d%H}|{dimension}|{key}|{action}"
+            ids.append(doc_id)
+            requests.append(UpdateOne(
+                {"_id": doc_id},
+                {
+                    "$set": {"count": count, "updated_at": now},
+                    "$setOnInsert": {
+                        "granularity": granularity,
+                        "bucket": bucket,
+                        "dimension": dimension,
+                        "key": key,
+                        "action": action
+                    }
+                },
+                upsert=True
+            ))
+        if requests:
+            mongo.db.activity_rollups.bulk_write(requests, ordered=False)
+        mongo.db.activity_rollups.delete_many({"granularity": granularity, "bucket": bucket, "_id": {"$nin": ids}})
+        return len(requests)
+
+    @staticmethod
+    def sum_buckets(granularity, start, end):
+        """Суммы счётчиков корзин [start, end) по (dimension, key, action)"""
+        pipeline = [
+            {"$match": {"granularity": granularity, "bucket": {"$gte": start, "$lt": end}}},
+            {"$group": {"_id": {"dimension": "$dimension", "key": "$key", "action": "$action"},
+                        "count": {"$sum": "$count"}}}
+        ]
+        return {
+            (row["_id"]["dimension"], row["_id"]["key"], row["_id"]["action"]): row["count"]
+            for row in mongo.db.activity_rollups.aggregate(pipeline)
+        }
+
+    @staticmethod
+    def _query(granularity, dimension, start, end, actions=None, keys=None):
+        query = {"granularity": granularity, "dimension": dimension, "bucket": {"$gte": start, "$lt": end}}
+        if actions:
+            query["action"] = {"$in": list(actions)}
+        if keys is not None:
+            query["key"] = {"$in": list(keys)}
+        return query
+
+    @staticmethod
+    def series(granularity, dimension, start, end, actions=None, keys=None):
+        """Счётчики по корзинам в порядке (bucket, key, action)"""
+        cursor = mongo.db.activity_rollups.find(
+            ActivityRollup._query(granularity, dimension, start, end, actions, keys),
+            {"_id": 0, "bucket": 1, "key": 1, "action": 1, "count": 1}
+        ).sort([("bucket", ASCENDING), ("key", ASCENDING), ("action", ASCENDING)])
+        return list(cursor)
+
+    @staticmethod
+    def top_keys(granularity, dimension, start, end, actions=None, keys=None, limit=10):
+        """Суммы за период по значениям измерения, от больших к меньшим"""
+        pipeline = [
+            {"$match": ActivityRollup._query(granularity, dimension, start, end, actions, keys)},
+            {"$group": {"_id": "$key", "count": {"$sum": "$count"}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": limit}
+        ]
+        return [{"key": row["_id"], "count": row["count"]} for row in mongo.db.activity_rollups.aggregate(pipeline)]
+
+    @staticmethod
+    def clear():
+        mongo.db.activity_rollups.delete_many({})
+
+
+class JobCheckpoint:
+    """Точка продолжения фоновых заданий (коллекция job_checkpoints)"""
+
+    @staticmethod
+    def get(job_id):
+        return mongo.db.job_checkpoints.find_one({"_id": job_id})
+
+    @staticmethod
+    def save(job_id, **state):
+        state["updated_at"] = datetime.utcnow()
+        mongo.db.job_checkpoints.update_one({"_id": job_id}, {"$set": state}, upsert=True)
+
+    @staticmethod
+    def delete(job_id):
+        mongo.db.job_checkpoints.delete_one({"_id": job_id})
+
+    @staticmethod
+    def acquire(job_id, owner, lease_seconds):
+        """Захват задания владельцем owner на lease_seconds; повторный вызов продлевает аренду.
+
+        False, если задание держит другой процесс и его аренда не истекла.
+        """
+        now = datetime.utcnow()
+        try:
+            mongo.db.job_checkpoints.find_one_and_update(
+                {"_id": job_id, "$or": [
+                    {"lease_owner": None},
+                    {"lease_owner": owner},
+                    {"lease_until": {"$lt": now}}
+                ]},
+                {"$set": {"lease_owner": owner, "lease_until": now + timedelta(seconds=lease_seconds)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Документ есть, но условие не выполнено: upsert пытается вставить тот же _id
+            return False
+        return True
+
+    @staticmethod
+    def release(job_id, owner):
+        mongo.db.job_checkpoints.update_one(
+            {"_id": job_id, "lease_owner": owner},
+            {"$unset": {"lease_owner": "", "lease_until": ""}}
+        )
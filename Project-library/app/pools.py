@@ -0,0 +1,183 @@
+import threading
+
+import redis
+from pymongo import monitoring
+
+
+def engine_options(app):
+    """Параметры пула SQLAlchemy из DB_POOL_*.
+
+    Для SQLite настройки пула и сетевые таймауты не применяются.
+    """
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite'):
+        return {}
+
+    options = {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT']
+    }
+    if uri.startswith('postgresql'):
+        connect_args = {'connect_timeout': app.config['DB_CONNECT_TIMEOUT']}
+        if app.config.get('DB_STATEMENT_TIMEOUT_MS'):
+            connect_args['options'] = f"-c statement_timeout={app.config['DB_STATEMENT_TIMEOUT_MS']}"
+        options['connect_args'] = connect_args
+    return options
+
+
+def mongo_options(app):
+    """Аргументы MongoClient: размер пула, очередь ожидания, таймауты"""
+    options = {
+        'maxPoolSize': app.config['MONGO_MAX_POOL_SIZE'],
+        'minPoolSize': app.config['MONGO_MIN_POOL_SIZE'],
+        'maxIdleTimeMS': app.config['MONGO_MAX_IDLE_TIME_MS'],
+        'waitQueueTimeoutMS': app.config['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+        'connectTimeoutMS': app.config['MONGO_CONNECT_TIMEOUT_MS'],
+        'socketTimeoutMS': app.config['MONGO_SOCKET_TIMEOUT_MS'],
+        'serverSelectionTimeoutMS': app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'event_listeners': [mongo_pool_monitor]
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def create_redis_client(app):
+    """Клиент Redis с общим пулом для redis_client и Flask-Caching.
+
+    BlockingConnectionPool при исчерпании пула ждёт REDIS_POOL_TIMEOUT
+    секунд, а не открывает новые соединения без ограничения.
+    """
+    options = {
+        'max_connections': app.config['REDIS_MAX_CONNECTIONS'],
+        'socket_timeout': app.config['REDIS_SOCKET_TIMEOUT'],
+        'socket_connect_timeout': app.config['REDIS_SOCKET_CONNECT_TIMEOUT'],
+        'health_check_interval': app.config['REDIS_HEALTH_CHECK_INTERVAL']
+    }
+    if app.config['REDIS_POOL_BLOCKING']:
+        pool = redis.BlockingConnectionPool.from_url(app.config['REDIS_URL'],
+                                                     timeout=app.config['REDIS_POOL_TIMEOUT'], **options)
+    else:
+        pool = redis.ConnectionPool.from_url(app.config['REDIS_URL'], **options)
+    return redis.Redis(connection_pool=pool)
+
+
+class MongoPoolMonitor(monitoring.ConnectionPoolListener):
+    """Счётчики пула соединений PyMongo по событиям CMAP (все серверы вместе)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "idle": max(self.open - self.checked_out, 0),
+                "waiting": self.waiting,
+                "checkout_failures": self.checkout_failures
+            }
+
+
+mongo_pool_monitor = MongoPoolMonitor()
+
+
+def _condition_waiters(condition):
+    # У threading.Condition нет публичного счётчика ожидающих потоков
+    waiters = getattr(condition, '_waiters', None)
+    return len(waiters) if waiters is not None else None
+
+
+def sqlalchemy_pool_stats(engine):
+    pool = engine.pool
+    stats = {"class": type(pool).__name__}
+    if hasattr(pool, 'checkedout'):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0)
+        })
+        queue = getattr(pool, '_pool', None)
+        if queue is not None and hasattr(queue, 'not_empty'):
+            stats["waiting"] = _condition_waiters(queue.not_empty)
+    return stats
+
+
+def redis_pool_stats(client):
+    pool = client.connection_pool
+    stats = {"class": type(pool).__name__, "max_connections": pool.max_connections}
+    if isinstance(pool, redis.BlockingConnectionPool):
+        idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+        created = len(pool._connections)
+        stats.update({
+            "created": created,
+            "checked_out": created - idle,
+            "idle": idle,
+            "waiting": _condition_waiters(pool.pool.not_empty)
+        })
+    elif hasattr(pool, '_in_use_connections'):
+        stats.update({
+            "created": pool._created_connections,
+            "checked_out": len(pool._in_use_connections),
+            "idle": len(pool._available_connections)
+        })
+    return stats
+
+
+def pool_stats():
+    """Текущая загрузка пулов соединений этого процесса"""
+    from . import db
+    from .cache import get_redis
+
+    return {
+        "postgres": sqlalchemy_pool_stats(db.engine),
+        "mongo": mongo_pool_monitor.stats(),
+        "redis": redis_pool_stats(get_redis())
+    }
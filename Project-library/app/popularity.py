@@ -0,0 +1,159 @@
+import json
+from datetime import date, datetime, timedelta
+from flask import current_app
+from redis.exceptions import RedisError
+from . import db
+from .models import Book, Rental
+from .cache import get_redis
+
+# Рейтинг популярности: число аренд по книге в sorted set'ах Redis
+POPULAR_ALL_KEY = 'popular:all'
+POPULAR_META_KEY = 'popular:books'
+
+
+def _day_key(day):
+    return f"popular:day:{day:%Y%m%d}"
+
+
+def _week_key(day):
+    year, week, _ = day.isocalendar()
+    return f"popular:week:{year}W{week:02d}"
+
+
+def _bucket_ttls():
+    # Корзины живут чуть дольше максимального окна, которое из них собирается
+    max_days = current_app.config['POPULAR_MAX_WINDOW_DAYS']
+    return (max_days + 2) * 86400, (max_days + 14) * 86400
+
+
+def _book_meta(title, author):
+    return json.dumps({"title": title, "author": author}, ensure_ascii=False)
+
+
+def record_rentals(rented, day=None):
+    """Учёт аренд в рейтинге: rented — список (book_id, title, author).
+
+    Один pipeline на запрос: ZINCRBY в общий рейтинг, в дневную и недельную
+    корзины, метаданные книг в hash для выдачи без обращения к Postgres.
+    Недоступность Redis не мешает аренде.
+    """
+    if not rented:
+        return
+    day = day or datetime.utcnow().date()
+    day_ttl, week_ttl = _bucket_ttls()
+    day_key, week_key = _day_key(day), _week_key(day)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for book_id, title, author in rented:
+            pipe.zincrby(POPULAR_ALL_KEY, 1, book_id)
+            pipe.zincrby(day_key, 1, book_id)
+            pipe.zincrby(week_key, 1, book_id)
+            pipe.hset(POPULAR_META_KEY, book_id, _book_meta(title, author))
+        pipe.expire(day_key, day_ttl)
+        pipe.expire(week_key, week_ttl)
+        pipe.execute()
+    except RedisError as e:
+        current_app.logger.warning(f"Could not record book popularity: {e}")
+
+
+def _window_buckets(days, today):
+    """Ключи корзин, покрывающих последние days дней.
+
+    Полные ISO-недели внутри окна берутся из недельных корзин, края окна —
+    из дневных, поэтому для месячного окна объединяется ~10 множеств, а не 30.
+    """
+    start = today - timedelta(days=days - 1)
+    keys = []
+    day = start
+    while day <= today:
+        week_end = day + timedelta(days=6)
+        if day.isoweekday() == 1 and week_end <= today:
+            keys.append(_week_key(day))
+            day = week_end + timedelta(days=1)
+        else:
+            keys.append(_day_key(day))
+            day += timedelta(days=1)
+    return keys
+
+
+def _window_key(days, today):
+    """Sorted set за скользящее окно: объединение корзин, кэшируемое на POPULAR_WINDOW_CACHE_TTL"""
+    key = f"popular:window:{days}:{today:%Y%m%d}"
+    redis_client = get_redis()
+    if not redis_client.exists(key):
+        pipe = redis_client.pipeline()
+        pipe.zunionstore(key, _window_buckets(days, today))
+        pipe.expire(key, current_app.config['POPULAR_WINDOW_CACHE_TTL'])
+        pipe.execute()
+    return key
+
+
+def get_popular_books(limit, days=None):
+    """Топ-N книг по числу аренд: за всё время или за последние days дней"""
+    key = POPULAR_ALL_KEY if days is None else _window_key(days, datetime.utcnow().date())
+    top = get_redis().zrevrange(key, 0, limit - 1, withscores=True)
+    if not top:
+        return []
+    metas = get_redis().hmget(POPULAR_META_KEY, [book_id for book_id, _ in top])
+    books = []
+    for (book_id, score), meta in zip(top, metas):
+        item = {"book_id": int(book_id), "rentals": int(score)}
+        if meta is not None:
+            item.update(json.loads(meta))
+        books.append(item)
+    return books
+
+
+def rebuild_popularity(batch_size=10000):
+    """Пересчёт рейтинга по таблице rentals.
+
+    Общий рейтинг собирается во временном ключе и подменяется атомарным
+    RENAME; корзины за последние POPULAR_MAX_WINDOW_DAYS дней
+    перезаписываются. Аренды, совершённые во время пересчёта, могут
+    не попасть в корзины — повторный запуск это исправит.
+    """
+    today = datetime.utcnow().date()
+    since = today - timedelta(days=current_app.config['POPULAR_MAX_WINDOW_DAYS'])
+    day_ttl, week_ttl = _bucket_ttls()
+
+    totals = {}
+    buckets = {}
+    rows = db.session.execute(
+        db.select(Rental.book_id, Rental.rental_date, db.func.count())
+        .group_by(Rental.book_id, Rental.rental_date)
+        .execution_options(yield_per=batch_size)
+    )
+    for book_id, rental_date, count in rows:
+        totals[book_id] = totals.get(book_id, 0) + count
+        if isinstance(rental_date, datetime):
+            rental_date = rental_date.date()
+        if isinstance(rental_date, date) and rental_date >= since:
+            for key, ttl in ((_day_key(rental_date), day_ttl), (_week_key(rental_date), week_ttl)):
+                bucket = buckets.setdefault(key, ({}, ttl))[0]
+                bucket[book_id] = bucket.get(book_id, 0) + count
+
+    redis_client = get_redis()
+    pipe = redis_client.pipeline()
+    tmp_key = f"{POPULAR_ALL_KEY}:rebuild"
+    pipe.delete(tmp_key)
+    if totals:
+        pipe.zadd(tmp_key, totals)
+        pipe.rename(tmp_key, POPULAR_ALL_KEY)
+    else:
+        pipe.delete(POPULAR_ALL_KEY)
+    for key, (scores, ttl) in buckets.items():
+        pipe.delete(key)
+        pipe.zadd(key, scores)
+        pipe.expire(key, ttl)
+    pipe.execute()
+
+    book_ids = list(totals)
+    for start in range(0, len(book_ids), batch_size):
+        chunk = book_ids[start:start + batch_size]
+        books = db.session.execute(
+            db.select(Book.book_id, Book.title, Book.author).where(Book.book_id.in_(chunk))
+        )
+        mapping = {book_id: _book_meta(title, author) for book_id, title, author in books}
+        if mapping:
+            redis_client.hset(POPULAR_META_KEY, mapping=mapping)
+    return len(totals)
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from . import db
+from .models import Book, Rental
+from .models_mongo import LogEntry
+
+
+def due_date_for(rental_date):
+    """Срок возврата по политике RENTAL_PERIOD_DAYS"""
+    return rental_date + timedelta(days=current_app.config['RENTAL_PERIOD_DAYS'])
+
+
+def _existing_book_ids(book_ids):
+    if not book_ids:
+        return set()
+    rows = db.session.query(Book.book_id).filter(Book.book_id.in_(book_ids)).all()
+    return {row.book_id for row in rows}
+
+
+def rent_books(user_id, book_ids):
+    """Пакетная аренда книг в одной транзакции.
+
+    Возвращает результаты по каждой книге, документы лога для одной
+    пакетной записи и список (book_id, title, author) выданных книг для
+    рейтинга популярности. Коммит выполняет вызывающий код.
+    """
+    results = []
+    rentals = []
+    now = datetime.utcnow()
+    for book_id in book_ids:
+        checked_out = Book.checkout(book_id)
+        if checked_out is None:
+            results.append({"book_id": book_id, "status": "unavailable"})
+            continue
+        rental = Rental(user_id=user_id, book_id=book_id, rental_date=now, due_date=due_date_for(now))
+        db.session.add(rental)
+        rentals.append((rental, checked_out))
+        results.append({"book_id": book_id, "status": "rented"})
+
+    _mark_missing(results, "unavailable")
+    db.session.flush()
+
+    entries = [
+        LogEntry.build(
+            action="rent_book",
+            user_id=user_id,
+            book_id=rental.book_id,
+            details={
+                "book_title": checked_out.title,
+                "rental_id": rental.rental_id,
+                "rental_date": rental.rental_date.isoformat(),
+                "batch": True
+            }
+        ) for rental, checked_out in rentals
+    ]
+    rented = [(rental.book_id, checked_out.title, checked_out.author) for rental, checked_out in rentals]
+    return results, entries, rented
+
+
+def return_books(user_id, book_ids):
+    """Пакетный возврат книг в одной транзакции"""
+    results = []
+    entries = []
+    now = datetime.utcnow()
+    for book_id in book_ids:
+        rental = Rental.close_open(user_id, book_id, now)
+        if rental is None:
+            results.append({"book_id": book_id, "status": "not_rented"})
+            continue
+        Book.checkin(book_id)
+        results.append({"book_id": book_id, "status": "returned"})
+        entries.append(LogEntry.build(
+            action="return_book",
+            user_id=user_id,
+            book_id=book_id,
+            details={
+                "rental_id": rental.rental_id,
+                "rental_date": rental.rental_date.isoformat(),
+                "return_date": rental.return_date.isoformat(),
+                "batch": True
+            }
+        ))
+
+    _mark_missing(results, "not_rented")
+    return results, entries
+
+
+def _mark_missing(results, failed_status):
+    """Уточнение статуса: книги, которых нет в каталоге, помечаются not_found"""
+    failed = [result["book_id"] for result in results if result["status"] == failed_status]
+    existing = _existing_book_ids(failed)
+    for result in results:
+        if result["status"] == failed_status and result["book_id"] not in existing:
+            result["status"] = "not_found"
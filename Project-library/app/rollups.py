@@ -0,0 +1,179 @@
+import os
+import socket
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select
+from . import db
+from .models import Book
+from .models_mongo import LogEntry, ActivityRollup, JobCheckpoint
+
+ROLLUP_JOB_ID = 'activity-rollup'
+GRANULARITIES = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+DIMENSIONS = ('action', 'book', 'genre')
+
+
+def bucket_start(timestamp, granularity):
+    """Начало часовой или суточной корзины, в которую попадает timestamp"""
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _load_genres(book_ids, genres):
+    # Жанры книг порции одним запросом; уже известные за этот запуск не запрашиваются
+    missing = [book_id for book_id in book_ids if book_id not in genres]
+    if missing:
+        rows = db.session.execute(select(Book.book_id, Book.genre).where(Book.book_id.in_(missing)))
+        genres.update({book_id: None for book_id in missing})
+        genres.update(dict(rows.all()))
+    return genres
+
+
+def _fold(entries, genres, counts):
+    # Счётчики одной часовой корзины: {(dimension, key, action): n}
+    for entry in entries:
+        action = entry.get("action")
+        book_id = entry.get("book_id")
+        genre = genres.get(book_id)
+        counts[('action', action, action)] += 1
+        if book_id is not None:
+            counts[('book', book_id, action)] += 1
+        if genre is not None:
+            counts[('genre', genre, action)] += 1
+    return counts
+
+
+def rollup_activity(batch_size=None, rebuild=False, since=None, progress=None):
+    """Свёртка записей логов в activity_rollups пересчётом затронутых корзин.
+
+    Логи читаются по возрастанию (timestamp, _id) от начала часа, в который
+    попадает отметка прошлого запуска минус ROLLUP_GRACE_SECONDS, и до
+    now - ROLLUP_LAG_SECONDS. Каждая часовая корзина пересчитывается по
+    логам целиком и записывается через $set, суточная — суммой своих
+    часовых, после чего сдвигается отметка. Поэтому повтор после сбоя не
+    удваивает счётчики, а записи, дописанные с опозданием (сброс очереди,
+    spill-файл), учитываются, если опоздали не больше чем на окно.
+    Одновременно выполняется только один запуск (аренда в job_checkpoints).
+    since пересчитывает сводки начиная с указанного времени, rebuild очищает
+    их и сворачивает все хранящиеся логи заново.
+    """
+    config = current_app.config
+    batch_size = batch_size or config['ROLLUP_BATCH_SIZE']
+    lease = config['ROLLUP_LEASE_SECONDS']
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if not JobCheckpoint.acquire(ROLLUP_JOB_ID, owner, lease):
+        return {"locked": True}
+
+    try:
+        if rebuild:
+            ActivityRollup.clear()
+            JobCheckpoint.save(ROLLUP_JOB_ID, last_timestamp=None, last_id=None)
+        checkpoint = JobCheckpoint.get(ROLLUP_JOB_ID) or {}
+        high_water_mark = checkpoint.get("last_timestamp")
+        if since is not None:
+            start = bucket_start(since, 'hour')
+        elif high_water_mark is not None:
+            start = bucket_start(high_water_mark - timedelta(seconds=config['ROLLUP_GRACE_SECONDS']), 'hour')
+        else:
+            start = None
+
+        until = datetime.utcnow() - timedelta(seconds=config['ROLLUP_LAG_SECONDS'])
+        summary = {
+            "rows": 0,
+            "counters": 0,
+            "buckets": 0,
+            "rescanned_from": start.isoformat() if start else None,
+            "high_water_mark": high_water_mark.isoformat() if high_water_mark else None,
+            "elapsed": 0.0,
+            "rows_per_sec": 0.0
+        }
+        started = time.perf_counter()
+        genres = {}
+
+        def fold(entries, counts):
+            _load_genres({entry.get("book_id") for entry in entries if entry.get("book_id") is not None}, genres)
+            _fold(entries, genres, counts)
+            summary["rows"] += len(entries)
+
+        def flush(hour, counts, last):
+            summary["counters"] += ActivityRollup.replace_bucket('hour', hour, counts)
+            day = bucket_start(hour, 'day')
+            ActivityRollup.replace_bucket('day', day, ActivityRollup.sum_buckets('hour', day, day + GRANULARITIES['day']))
+            summary["buckets"] += 1
+            # Отметка не отступает назад при пересчёте уже свёрнутого периода
+            if high_water_mark is None or last["timestamp"] > high_water_mark:
+                JobCheckpoint.save(ROLLUP_JOB_ID, last_timestamp=last["timestamp"], last_id=last["_id"])
+                summary["high_water_mark"] = last["timestamp"].isoformat()
+            JobCheckpoint.acquire(ROLLUP_JOB_ID, owner, lease)
+            summary["elapsed"] = round(time.perf_counter() - started, 3)
+            summary["rows_per_sec"] = round(summary["rows"] / summary["elapsed"], 1) if summary["elapsed"] else 0.0
+            if progress is not None:
+                progress(summary)
+
+        hour = None
+        counts = Counter()
+        entries = []
+        last = None
+        for entry in LogEntry.iter_range(start, until, batch_size=batch_size):
+            entry_hour = bucket_start(entry["timestamp"], 'hour')
+            if entry_hour != hour:
+                if hour is not None:
+                    fold(entries, counts)
+                    flush(hour, counts, last)
+                hour = entry_hour
+                counts = Counter()
+                entries = []
+            entries.append(entry)
+            last = entry
+            if len(entries) >= batch_size:
+                fold(entries, counts)
+                entries = []
+        if hour is not None:
+            fold(entries, counts)
+            flush(hour, counts, last)
+        db.session.rollback()
+    finally:
+        JobCheckpoint.release(ROLLUP_JOB_ID, owner)
+
+    summary["elapsed"] = round(time.perf_counter() - started, 3)
+    summary["rows_per_sec"] = round(summary["rows"] / summary["elapsed"], 1) if summary["elapsed"] else 0.0
+    return summary
+
+
+def stats_window(granularity, start=None, end=None):
+    """Границы периода, выровненные по корзинам; ValueError для слишком длинного периода.
+
+    По умолчанию — последние сутки по часам или последние 30 дней по дням,
+    включая текущую корзину.
+    """
+    step = GRANULARITIES[granularity]
+    end = bucket_start(end, granularity) if end else bucket_start(datetime.utcnow(), granularity) + step
+    start = bucket_start(start, granularity) if start else end - (24 * step if granularity == 'hour' else 30 * step)
+    if start >= end:
+        raise ValueError("start must be earlier than end")
+    if (end - start) / step > current_app.config['STATS_MAX_BUCKETS']:
+        raise ValueError(f"Period is too long: at most {current_app.config['STATS_MAX_BUCKETS']} buckets")
+    return start, end
+
+
+def get_stats(granularity, dimension, start, end, actions=None, keys=None, limit=10):
+    """Ответ /stats/ из сводок: итоги по значениям измерения и ряды по корзинам.
+
+    Без keys ряды строятся для limit значений с наибольшими итогами.
+    """
+    totals = ActivityRollup.top_keys(granularity, dimension, start, end, actions, keys, limit)
+    series = ActivityRollup.series(granularity, dimension, start, end, actions,
+                                   [total["key"] for total in totals])
+    checkpoint = JobCheckpoint.get(ROLLUP_JOB_ID) or {}
+    high_water_mark = checkpoint.get("last_timestamp")
+    return {
+        "granularity": granularity,
+        "dimension": dimension,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "totals": totals,
+        "series": [dict(row, bucket=row["bucket"].isoformat()) for row in series],
+        "updated_to": high_water_mark.isoformat() if high_water_mark else None
+    }
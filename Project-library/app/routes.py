@@ -1,19 +1,29 @@
-from flask import jsonify, request, current_app as app
+import jwt
+from flask import jsonify, request, Response, abort, stream_with_context, current_app as app
 from flask_login import login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from . import db, login_manager, cache
+from sqlalchemy.exc import IntegrityError
+from . import db, cache, log_writer
 from .models import User, Book, Rental
-from .models_mongo import LogEntry, BookReview
-from .utils import generate_access_token, generate_refresh_token, checkUser
-from .cache import cached, delete_cache, clear_book_cache
+from .models_mongo import LogEntry, BookReview, RatingSummary, REVIEW_FIELDS, RATING_VALUES, decode_review_cursor
+from .utils import generate_access_token, generate_refresh_token, decode_token, checkUser, parse_page_args
+from .auth import TokenUser, revoke_token, is_token_revoked
+from .dashboard import dashboard_role, get_dashboard_payload, get_catalog_page, catalog_page_key, catalog_page_params, dashboard_payload_key
+from .rentals import rent_books, return_books, due_date_for
+from .importer import import_books, IMPORT_FORMATS
+from .book_detail import get_book_detail, invalidate_book_detail
+from .search import get_search_page, normalize_query
+from .popularity import record_rentals, get_popular_books
+from .cache import clear_book_cache, cache_stats, get_raw, set_raw, get_catalog_generation, \
+    get_review_version, bump_review_version, get_ratings_version, bump_ratings_version, bump_search_version
+from .http_cache import versioned_response, make_etag, args_digest
+from .pools import pool_stats
+from .log_export import export_chunks, parse_time, parse_resume_token
+from .rollups import get_stats, stats_window, GRANULARITIES, DIMENSIONS
 from datetime import datetime
 from flasgger import swag_from
 
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
 @app.route('/')
 def hello_page():
     return jsonify(
@@ -85,8 +95,8 @@ def register():
     db.session.commit()
     user = User.query.filter_by(username=username).first()
     login_user(user)
-    access_token = generate_access_token(user.user_id)
-    refresh_token = generate_refresh_token(user.user_id)
+    access_token = generate_access_token(user.user_id, user.role)
+    refresh_token = generate_refresh_token(user.user_id, user.role)
     return jsonify(
         {
         "message": "Registration successful!",
@@ -137,8 +147,8 @@ def login():
     user = User.query.filter_by(username=username).first()
     if user and check_password_hash(user.password_hash, password):
         login_user(user)
-        access_token = generate_access_token(user.user_id)
-        refresh_token = generate_refresh_token(user.user_id)
+        access_token = generate_access_token(user.user_id, user.role)
+        refresh_token = generate_refresh_token(user.user_id, user.role)
         return jsonify(
             {
                 "message": "Login successful!",
@@ -164,6 +174,9 @@ def login():
     }
 })
 def logout():
+    # Выход по bearer-токену отзывает сам токен
+    if isinstance(current_user._get_current_object(), TokenUser):
+        revoke_token(current_user.jti, current_user.exp)
     logout_user()
     return jsonify(
         {
@@ -175,86 +188,229 @@ def logout():
 @login_required
 @swag_from({
     'tags': ['Book'],
+    'parameters': [
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Page size (capped by MAX_PAGE_SIZE)'
+        },
+        {
+            'name': 'cursor',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'book_id of the last book on the previous page'
+        },
+        {
+            'name': 'genre',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Filter by genre'
+        },
+        {
+            'name': 'author',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Filter by author'
+        },
+        {
+            'name': 'available',
+            'in': 'query',
+            'type': 'boolean',
+            'description': 'Filter by availability (admins only, readers always see available books)'
+        },
+        {
+            'name': 'with_ratings',
+            'in': 'query',
+            'type': 'boolean',
+            'description': 'Embed the rating summary of every book'
+        }
+    ],
     'responses': {
         '200': {
-            'description': 'A list of books',
+            'description': 'A page of books',
             'schema': {
-                'type': 'array',
-                'items': {
-                    'type': 'object',
-                    'properties': {
-                        'book_id': {
-                            'type': 'integer',
-                            'description': 'The book ID'
-                        },
-                        'title': {
-                            'type': 'string',
-                            'description': 'The book title'
-                        },
-                        'author': {
-                            'type': 'string',
-                            'description': 'The book author'
-                        },
-                        'genre': {
-                            'type': 'string',
-                            'description': 'The book genre'
-                        },
-                        'available_copies': {
-                            'type': 'integer',
-                            'description': 'The number of available copies'
-                        },
-                        'total_copies': {
-                            'type': 'integer',
-                            'description': 'The total number of copies'
+                'type': 'object',
+                'properties': {
+                    'books': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'book_id': {
+                                    'type': 'integer',
+                                    'description': 'The book ID'
+                                },
+                                'title': {
+                                    'type': 'string',
+                                    'description': 'The book title'
+                                },
+                                'author': {
+                                    'type': 'string',
+                                    'description': 'The book author'
+                                },
+                                'genre': {
+                                    'type': 'string',
+                                    'description': 'The book genre'
+                                },
+                                'available_copies': {
+                                    'type': 'integer',
+                                    'description': 'The number of available copies'
+                                },
+                                'total_copies': {
+                                    'type': 'integer',
+                                    'description': 'The total number of copies'
+                                }
+                            }
                         }
+                    },
+                    'next_cursor': {
+                        'type': 'integer',
+                        'description': 'Cursor for the next page, null on the last page'
                     }
                 }
             }
+        },
+        '304': {
+            'description': 'Not modified: If-None-Match matches the current catalog generation'
         }
     }
 })
-@cache.cached(timeout=300, key_prefix='dashboard_view_%s_%s',
-              make_cache_key=lambda *args, **kwargs: f"dashboard_view_{current_user.user_id}_{current_user.role}")
 def dashboard():
     user_id = current_user.user_id
-    role = current_user.role
+    role = dashboard_role(current_user.role)
 
     # Логирование в MongoDB
     LogEntry.create(
         action="view_dashboard",
         user_id=user_id,
-        details={"role": role}
+        details={"role": current_user.role}
     )
 
-    if role == 'admin':
-        books = Book.query.all()
-        return jsonify(
-            [
-                {
-                    "book_id": book.book_id,
-                    "title": book.title,
-                    "author": book.author,
-                    "genre": book.genre,
-                    "available_copies": book.available_copies,
-                    "total_copies": book.total_copies
-                } for book in books
-            ]
-        ), 200
+    # ETag по поколению каталога: при совпадении с If-None-Match ответ 304 без чтения кэша
+    generation = get_catalog_generation()
+    args = catalog_page_params(role, request.args)
+
+    # Первая страница без фильтров предвычислена для роли, остальные кэшируются по роли
+    if args:
+        digest = args_digest(args)
+        # Страницы с оценками меняются и при новых отзывах
+        ratings_version = get_ratings_version() if args.get('with_ratings') else None
+        etag = make_etag('catalog', role, generation, digest) if ratings_version is None \
+            else make_etag('catalog', role, generation, f"r{ratings_version}", digest)
+
+        def load():
+            body = get_catalog_page(role, args, generation, ratings_version)
+            return body, etag, catalog_page_key(role, args, generation, ratings_version)
     else:
-        available_books = Book.query.filter(Book.available_copies > 0).all()
+        def load():
+            stored_generation, body = get_dashboard_payload(role, generation)
+            return body, make_etag('dashboard', role, stored_generation), \
+                dashboard_payload_key(role, stored_generation)
+
+        etag = make_etag('dashboard', role, generation)
+
+    return versioned_response(etag, load, cache_control='private, no-cache', vary=('Cookie', 'Authorization'))
+
+@app.route('/books/search/', methods=['GET'])
+@swag_from({
+    'tags': ['Book'],
+    'parameters': [
+        {
+            'name': 'q',
+            'in': 'query',
+            'required': True,
+            'type': 'string',
+            'description': 'Search query over title, author and genre'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Page size (capped by MAX_PAGE_SIZE)'
+        },
+        {
+            'name': 'cursor',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'next_cursor from the previous page'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Books ranked by relevance with next_cursor'
+        },
+        '400': {
+            'description': 'Missing or too long query'
+        }
+    }
+})
+def search_books_view():
+    q = normalize_query(request.args.get('q'))
+    if not q or len(q) > app.config['SEARCH_MAX_QUERY_LENGTH']:
         return jsonify(
-            [
-                {
-                    "book_id": book.book_id,
-                    "title": book.title,
-                    "author": book.author,
-                    "genre": book.genre,
-                    "available_copies": book.available_copies,
-                    "total_copies": book.total_copies
-                } for book in available_books
-            ]
+            {
+                "message": f"Query q is required and must be at most {app.config['SEARCH_MAX_QUERY_LENGTH']} characters."
+            }
+        ), 400
+    limit, cursor = parse_page_args(request.args, app.config['SEARCH_PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    offset = max(cursor or 0, 0)
+    if offset >= app.config['SEARCH_MAX_RESULTS']:
+        return jsonify(
+            {
+                "books": [],
+                "next_cursor": None
+            }
         ), 200
 
+    body = get_search_page(q, limit, offset)
+    return Response(body, status=200, mimetype='application/json')
+
+@app.route('/books/popular/', methods=['GET'])
+@swag_from({
+    'tags': ['Book'],
+    'parameters': [
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Number of books (capped by POPULAR_MAX_LIMIT)'
+        },
+        {
+            'name': 'days',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Rolling window in days; all-time ranking when omitted'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Most rented books with rental counts'
+        },
+        '400': {
+            'description': 'Invalid window'
+        }
+    }
+})
+def popular_books():
+    limit = request.args.get('limit', app.config['POPULAR_DEFAULT_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['POPULAR_MAX_LIMIT']))
+    days = request.args.get('days', type=int)
+    if days is not None and not 1 <= days <= app.config['POPULAR_MAX_WINDOW_DAYS']:
+        return jsonify(
+            {
+                "message": f"days must be between 1 and {app.config['POPULAR_MAX_WINDOW_DAYS']}."
+            }
+        ), 400
+
+    # Только Redis: sorted set рейтинга и hash с названиями книг
+    return jsonify(
+        {
+            "window_days": days,
+            "books": get_popular_books(limit, days)
+        }
+    ), 200
+
 @app.route('/add_book/', methods=['POST'])
 @login_required
 @swag_from({
@@ -298,6 +454,9 @@ def dashboard():
         },
         '403': {
             'description': 'You do not have permission to access this page.'
+        },
+        '409': {
+            'description': 'Book with this title and author already exists.'
         }
     }
 })
@@ -315,7 +474,15 @@ def add_book():
     total_copies = data['total_copies']
     new_book = Book(title=title, author=author, genre=genre, available_copies=total_copies, total_copies=total_copies)
     db.session.add(new_book)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(
+            {
+                "message": "Book with this title and author already exists."
+            }
+        ), 409
 
     # Логирование в MongoDB
     LogEntry.create(
@@ -330,7 +497,8 @@ def add_book():
         }
     )
 
-    # Очистка кэша книг
+    # Очистка кэша книг и результатов поиска
+    bump_search_version()
     clear_book_cache()
 
     return jsonify(
@@ -339,6 +507,70 @@ def add_book():
         }
     ), 201
 
+@app.route('/admin/books/import/', methods=['POST'])
+@login_required
+@swag_from({
+    'tags': ['Book'],
+    'consumes': ['text/csv', 'application/x-ndjson'],
+    'parameters': [
+        {
+            'name': 'format',
+            'in': 'query',
+            'type': 'string',
+            'description': 'csv/jsonl (by default derived from Content-Type)'
+        },
+        {
+            'name': 'batch_size',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Rows per INSERT batch'
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'description': 'CSV with header title,author,genre,total_copies or JSON Lines with the same fields'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Import summary'
+        },
+        '400': {
+            'description': 'Unsupported import format.'
+        },
+        '403': {
+            'description': 'You do not have permission to access this page.'
+        }
+    }
+})
+def import_books_view():
+    if current_user.role != 'admin':
+        return jsonify(
+            {
+                "message": "You do not have permission to access this page."
+            }
+        ), 403
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+    if fmt not in IMPORT_FORMATS:
+        return jsonify(
+            {
+                "message": "Unsupported import format."
+            }
+        ), 400
+    batch_size = request.args.get('batch_size', app.config['IMPORT_BATCH_SIZE'], type=int)
+
+    # Тело читается потоком, без загрузки файла в память целиком
+    summary = import_books(
+        request.stream, fmt,
+        user_id=current_user.user_id,
+        batch_size=max(1, batch_size),
+        progress=lambda s: app.logger.info(f"Import batch {s['batches']}: {s['upserted']} upserted")
+    )
+    return jsonify(summary), 200
+
 @app.route('/rent_book/<int:book_id>/', methods=['POST'])
 @login_required
 @swag_from({
@@ -361,6 +593,9 @@ def add_book():
         },
         '403': {
             'description': 'Admins cannot rent books.'
+        },
+        '404': {
+            'description': 'Book not found.'
         }
     }
 })
@@ -371,40 +606,48 @@ def rent_book(book_id):
                 "message": "Admins cannot rent books."
              }
         ), 403
-    book = Book.query.get_or_404(book_id)
-    if book.available_copies > 0:
-        book.available_copies -= 1
-        new_rental = Rental(user_id=current_user.user_id, book_id=book.book_id, rental_date=datetime.utcnow())
-        db.session.add(new_rental)
-        db.session.commit()
-
-        # Логирование в MongoDB
-        LogEntry.create(
-            action="rent_book",
-            user_id=current_user.user_id,
-            book_id=book_id,
-            details={
-                "book_title": book.title,
-                "rental_id": new_rental.rental_id,
-                "rental_date": new_rental.rental_date.isoformat()
-            }
-        )
-
-        # Очистка кэша книг
-        clear_book_cache()
-
-        return jsonify(
-            {
-                "message": "Book rented successfully!"
-            }
-        ), 200
-    else:
+    # Условное списание экземпляра: без гонок и потерянных обновлений
+    checked_out = Book.checkout(book_id)
+    if checked_out is None:
+        db.session.rollback()
+        if db.session.get(Book, book_id) is None:
+            abort(404)
         return jsonify(
             {
                 "message": "No available copies of this book."
             }
         ), 400
 
+    rental_date = datetime.utcnow()
+    new_rental = Rental(user_id=current_user.user_id, book_id=book_id, rental_date=rental_date,
+                        due_date=due_date_for(rental_date))
+    db.session.add(new_rental)
+    db.session.commit()
+
+    # Логирование в MongoDB
+    LogEntry.create(
+        action="rent_book",
+        user_id=current_user.user_id,
+        book_id=book_id,
+        details={
+            "book_title": checked_out.title,
+            "rental_id": new_rental.rental_id,
+            "rental_date": new_rental.rental_date.isoformat(),
+            "due_date": new_rental.due_date.isoformat()
+        }
+    )
+
+    # Очистка кэша книг
+    clear_book_cache()
+    record_rentals([(book_id, checked_out.title, checked_out.author)])
+
+    return jsonify(
+        {
+            "message": "Book rented successfully!",
+            "due_date": new_rental.due_date.isoformat()
+        }
+    ), 200
+
 @app.route('/refresh/', methods=['POST'])
 @swag_from({
     'tags': ['Token'],
@@ -439,9 +682,17 @@ def refresh():
     data = request.get_json()
     refresh_token = data['refresh_token']
     try:
-        payload = jwt.decode(refresh_token, 'liba', algorithms=['HS256'])
+        payload = decode_token(refresh_token, 'refresh')
+        if is_token_revoked(payload.get('jti')):
+            raise jwt.InvalidTokenError("Token has been revoked")
         user_id = payload['user_id']
-        access_token = generate_access_token(user_id)
+        role = payload.get('role')
+        if role is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                raise jwt.InvalidTokenError("Unknown user")
+            role = user.role
+        access_token = generate_access_token(user_id, role)
         return jsonify(
             {
                 "access_token": access_token
@@ -461,6 +712,34 @@ def refresh():
         ), 401
 
 
+@app.route('/book/<int:book_id>/', methods=['GET'])
+@swag_from({
+    'tags': ['Book'],
+    'parameters': [
+        {
+            'name': 'book_id',
+            'in': 'path',
+            'required': True,
+            'type': 'integer',
+            'description': 'The ID of the book'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Book card: book row, recent reviews, rating summary and recent activity'
+        },
+        '404': {
+            'description': 'Book not found.'
+        }
+    }
+})
+def get_book(book_id):
+    response = get_book_detail(book_id)
+    if response is False:
+        abort(404)
+    return response
+
+
 @app.route('/book/<int:book_id>/reviews/', methods=['GET'])
 @swag_from({
     'tags': ['Review'],
@@ -471,26 +750,113 @@ def refresh():
             'required': True,
             'type': 'integer',
             'description': 'The ID of the book'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Page size (capped by MAX_PAGE_SIZE)'
+        },
+        {
+            'name': 'cursor',
+            'in': 'query',
+            'type': 'string',
+            'description': 'next_cursor from the previous page'
+        },
+        {
+            'name': 'order',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Sort order by created_at: desc (default) or asc'
+        },
+        {
+            'name': 'fields',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Comma-separated projection, e.g. rating,review_text'
         }
     ],
     'responses': {
         '200': {
-            'description': 'List of reviews for the book'
+            'description': 'A page of reviews for the book with next_cursor'
+        },
+        '304': {
+            'description': 'Not modified: If-None-Match matches the current review version'
+        },
+        '400': {
+            'description': 'Invalid query parameters'
         }
     }
 })
 def get_book_reviews(book_id):
-    # Проверка существования книги
-    book = Book.query.get_or_404(book_id)
+    limit = request.args.get('limit', app.config['REVIEWS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    order = request.args.get('order', 'desc')
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    if order not in ('asc', 'desc') or any(field not in REVIEW_FIELDS for field in fields):
+        return jsonify(
+            {
+                "message": f"order must be asc/desc, fields must be a subset of {', '.join(REVIEW_FIELDS)}"
+            }
+        ), 400
+    cursor = request.args.get('cursor')
+    try:
+        if cursor is not None:
+            decode_review_cursor(cursor)
+    except ValueError:
+        return jsonify(
+            {
+                "message": "Invalid cursor"
+            }
+        ), 400
 
-    # Получение отзывов из MongoDB
-    reviews = BookReview.get_book_reviews(book_id)
+    # ETag по версии отзывов книги: при совпадении ответ 304 без запросов к БД
+    version = get_review_version(book_id)
+    digest = args_digest(request.args)
+    etag = make_etag('reviews', book_id, version, digest)
+
+    def load():
+        key = f"reviews:{book_id}:v{version}:{digest}"
+        body = get_raw(key)
+        if body is None:
+            # Проверка существования книги
+            Book.query.get_or_404(book_id)
+
+            # Получение страницы отзывов из MongoDB
+            reviews, next_cursor = BookReview.get_book_reviews(
+                book_id,
+                limit=limit,
+                cursor=cursor,
+                fields=fields,
+                ascending=order == 'asc'
+            )
+            body = app.json.dumps({"reviews": reviews, "next_cursor": next_cursor}).encode('utf-8')
+            set_raw(key, body, app.config['CACHE_TIMEOUT'])
+        return body, etag, key
+
+    return versioned_response(etag, load)
 
-    # Преобразование ObjectId в строку для JSON
-    for review in reviews:
-        review['_id'] = str(review['_id'])
 
-    return jsonify(reviews), 200
+@app.route('/book/<int:book_id>/rating/', methods=['GET'])
+@swag_from({
+    'tags': ['Review'],
+    'parameters': [
+        {
+            'name': 'book_id',
+            'in': 'path',
+            'required': True,
+            'type': 'integer',
+            'description': 'The ID of the book'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Rating summary: count, average and histogram'
+        }
+    }
+})
+def get_book_rating(book_id):
+    return jsonify(RatingSummary.get(book_id)), 200
 
 
 @app.route('/book/<int:book_id>/review/', methods=['POST'])
@@ -530,6 +896,9 @@ def get_book_reviews(book_id):
     'responses': {
         '201': {
             'description': 'Review added successfully!'
+        },
+        '400': {
+            'description': 'Rating must be an integer from 1 to 5.'
         }
     }
 })
@@ -540,6 +909,12 @@ def add_book_review(book_id):
     data = request.get_json()
     rating = data['rating']
     review_text = data['review_text']
+    if not isinstance(rating, int) or isinstance(rating, bool) or rating not in RATING_VALUES:
+        return jsonify(
+            {
+                "message": "Rating must be an integer from 1 to 5."
+            }
+        ), 400
 
     # Создание отзыва в MongoDB
     review = BookReview.create(
@@ -549,6 +924,10 @@ def add_book_review(book_id):
         review_text=review_text
     )
 
+    invalidate_book_detail(book_id)
+    bump_review_version(book_id)
+    bump_ratings_version()
+
     # Логирование
     LogEntry.create(
         action="add_review",
@@ -588,6 +967,62 @@ def get_user_activity():
 
     return jsonify(logs), 200
 
+@app.route('/user/rentals/', methods=['GET'])
+@login_required
+@swag_from({
+    'tags': ['User'],
+    'parameters': [
+        {
+            'name': 'status',
+            'in': 'query',
+            'type': 'string',
+            'description': 'open, closed or all (default)'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Page size (capped by MAX_PAGE_SIZE)'
+        },
+        {
+            'name': 'cursor',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'rental_id of the last rental on the previous page'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'A page of the user rental history, newest first, with next_cursor'
+        },
+        '400': {
+            'description': 'Invalid status'
+        }
+    }
+})
+def get_user_rentals():
+    status = request.args.get('status', 'all')
+    if status not in ('open', 'closed', 'all'):
+        return jsonify(
+            {
+                "message": "status must be open, closed or all."
+            }
+        ), 400
+    limit, cursor = parse_page_args(request.args, app.config['RENTALS_PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+
+    rows, next_cursor = Rental.user_history(
+        current_user.user_id,
+        status=None if status == 'all' else status,
+        limit=limit,
+        cursor=cursor
+    )
+    return jsonify(
+        {
+            "rentals": [dict(rental.to_dict(), title=title) for rental, title in rows],
+            "next_cursor": next_cursor
+        }
+    ), 200
+
 @app.route('/book/<int:book_id>/return/', methods=['POST'])
 @login_required
 @swag_from({
@@ -611,17 +1046,12 @@ def get_user_activity():
     }
 })
 def return_book(book_id):
-    rental = Rental.query.filter_by(
-        user_id=current_user.user_id,
-        book_id=book_id,
-        return_date=None
-    ).first_or_404()
-
-    rental.return_date = datetime.utcnow()
-
-    book = Book.query.get(book_id)
-    book.available_copies += 1
-
+    # Закрытие аренды и возврат экземпляра условными UPDATE в одной транзакции
+    rental = Rental.close_open(current_user.user_id, book_id, datetime.utcnow())
+    if rental is None:
+        db.session.rollback()
+        abort(404)
+    Book.checkin(book_id)
     db.session.commit()
 
     # Логирование в MongoDB
@@ -642,6 +1072,308 @@ def return_book(book_id):
         "message": "Book returned successfully!"
     }), 200
 
+@app.route('/rentals/batch/', methods=['POST'])
+@login_required
+@swag_from({
+    'tags': ['Rental'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'id': 'RentalBatch',
+                'required': ['action', 'book_ids'],
+                'properties': {
+                    'action': {
+                        'type': 'string',
+                        'description': 'rent/return',
+                        'default': 'rent'
+                    },
+                    'book_ids': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'integer'
+                        },
+                        'description': 'IDs of the books (at most MAX_BATCH_RENTALS)',
+                        'default': [1, 2]
+                    }
+                }
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Per-book results: rented/unavailable/returned/not_rented/not_found'
+        },
+        '400': {
+            'description': 'Invalid batch request.'
+        },
+        '403': {
+            'description': 'Admins cannot rent books.'
+        }
+    }
+})
+def rent_batch():
+    data = request.get_json()
+    action = data.get('action')
+    book_ids = data.get('book_ids')
+    if action not in ('rent', 'return') or not isinstance(book_ids, list) \
+            or not all(isinstance(book_id, int) for book_id in book_ids):
+        return jsonify(
+            {
+                "message": "Expected action 'rent' or 'return' and a list of integer book_ids."
+            }
+        ), 400
+    if len(book_ids) > app.config['MAX_BATCH_RENTALS']:
+        return jsonify(
+            {
+                "message": f"At most {app.config['MAX_BATCH_RENTALS']} books per batch."
+            }
+        ), 400
+    if action == 'rent' and current_user.role == 'admin':
+        return jsonify(
+            {
+                "message": "Admins cannot rent books."
+            }
+        ), 403
+
+    # Все книги обрабатываются в одной транзакции
+    rented = []
+    if action == 'rent':
+        results, entries, rented = rent_books(current_user.user_id, book_ids)
+    else:
+        results, entries = return_books(current_user.user_id, book_ids)
+    db.session.commit()
+
+    # Одна пакетная запись лога и одна инвалидация кэша на весь запрос
+    if entries:
+        LogEntry.create_many(entries)
+        clear_book_cache()
+    record_rentals(rented)
+
+    return jsonify(
+        {
+            "results": results,
+            "processed": len(entries)
+        }
+    ), 200
+
+@app.route('/admin/metrics/', methods=['GET'])
+@login_required
+@swag_from({
+    'tags': ['Admin'],
+    'responses': {
+        '200': {
+            'description': 'Internal counters: log writer queue and flush latency, cache hits/misses per layer, connection pool utilization'
+        },
+        '403': {
+            'description': 'You do not have permission to access this page.'
+        }
+    }
+})
+def admin_metrics():
+    if current_user.role != 'admin':
+        return jsonify(
+            {
+                "message": "You do not have permission to access this page."
+            }
+        ), 403
+    return jsonify(
+        {
+            "log_writer": log_writer.stats(),
+            "cache": cache_stats(),
+            "pools": pool_stats()
+        }
+    ), 200
+
+@app.route('/admin/logs/export/', methods=['GET'])
+@login_required
+@swag_from({
+    'tags': ['Admin'],
+    'produces': ['application/x-ndjson', 'application/gzip'],
+    'parameters': [
+        {
+            'name': 'start',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Lower bound of timestamp, ISO 8601 UTC (inclusive)'
+        },
+        {
+            'name': 'end',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Upper bound of timestamp, ISO 8601 UTC (exclusive)'
+        },
+        {
+            'name': 'action',
+            'in': 'query',
+            'type': 'array',
+            'items': {'type': 'string'},
+            'collectionFormat': 'multi',
+            'description': 'Actions to export (repeatable), all by default'
+        },
+        {
+            'name': 'after',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Resume token "<timestamp>|<_id>" of the last received line'
+        },
+        {
+            'name': 'compress',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['gzip'],
+            'description': 'Return a .ndjson.gz file'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Logs as newline-delimited JSON ordered by (timestamp, _id)'
+        },
+        '400': {
+            'description': 'Invalid export parameters.'
+        },
+        '403': {
+            'description': 'You do not have permission to access this page.'
+        }
+    }
+})
+def export_logs_view():
+    if current_user.role != 'admin':
+        return jsonify(
+            {
+                "message": "You do not have permission to access this page."
+            }
+        ), 403
+    compress = request.args.get('compress')
+    try:
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+        after = request.args.get('after')
+        after = parse_resume_token(after) if after else None
+        if compress not in (None, 'gzip'):
+            raise ValueError(f"Unsupported compression: {compress}")
+    except ValueError as e:
+        return jsonify(
+            {
+                "message": str(e)
+            }
+        ), 400
+    actions = request.args.getlist('action')
+
+    # Тело отдаётся по мере чтения курсора: память не зависит от объёма выгрузки
+    chunks = export_chunks(start, end, actions, after, compress=compress == 'gzip')
+    body = stream_with_context(data for data, _, _ in chunks)
+    if compress == 'gzip':
+        response = Response(body, mimetype='application/gzip')
+        filename = 'logs.ndjson.gz'
+    else:
+        response = Response(body, mimetype='application/x-ndjson')
+        filename = 'logs.ndjson'
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/stats/', methods=['GET'])
+@login_required
+@swag_from({
+    'tags': ['Admin'],
+    'parameters': [
+        {
+            'name': 'granularity',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['hour', 'day'],
+            'description': 'Bucket size, hour by default'
+        },
+        {
+            'name': 'dimension',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['action', 'book', 'genre'],
+            'description': 'Counters per action (default), per book or per genre'
+        },
+        {
+            'name': 'start',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Period start, ISO 8601 UTC (default: 24 hours or 30 days ago)'
+        },
+        {
+            'name': 'end',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Period end, ISO 8601 UTC, exclusive (default: end of the current bucket)'
+        },
+        {
+            'name': 'action',
+            'in': 'query',
+            'type': 'array',
+            'items': {'type': 'string'},
+            'collectionFormat': 'multi',
+            'description': 'Only these actions (repeatable)'
+        },
+        {
+            'name': 'key',
+            'in': 'query',
+            'type': 'array',
+            'items': {'type': 'string'},
+            'collectionFormat': 'multi',
+            'description': 'Only these book IDs or genres (repeatable); top keys by count when omitted'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Number of keys (capped by STATS_MAX_LIMIT)'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Totals per key and per-bucket series from the activity rollups'
+        },
+        '400': {
+            'description': 'Invalid stats parameters.'
+        },
+        '403': {
+            'description': 'You do not have permission to access this page.'
+        }
+    }
+})
+def activity_stats():
+    if current_user.role != 'admin':
+        return jsonify(
+            {
+                "message": "You do not have permission to access this page."
+            }
+        ), 403
+    granularity = request.args.get('granularity', 'hour')
+    dimension = request.args.get('dimension', 'action')
+    limit = request.args.get('limit', app.config['STATS_DEFAULT_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['STATS_MAX_LIMIT']))
+    try:
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unsupported granularity: {granularity}")
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unsupported dimension: {dimension}")
+        keys = request.args.getlist('key') or None
+        if keys and dimension == 'book':
+            keys = [int(key) for key in keys]
+        start, end = stats_window(granularity, parse_time(request.args.get('start')),
+                                  parse_time(request.args.get('end')))
+    except (ValueError, OverflowError) as e:
+        # OverflowError — период у границ диапазона datetime
+        return jsonify(
+            {
+                "message": str(e)
+            }
+        ), 400
+
+    # Только предварительно свёрнутые счётчики: коллекция logs не читается
+    stats = get_stats(granularity, dimension, start, end, request.args.getlist('action'), keys, limit)
+    return jsonify(stats), 200
+
 # Функция для очистки кэша:
 def clear_cache():
     cache.clear()
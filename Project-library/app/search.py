@@ -0,0 +1,173 @@
+import hashlib
+import re
+from flask import current_app
+from sqlalchemy import func, literal, literal_column, or_, select, text
+from . import db
+from .models import Book
+from .cache import get_search_version, get_redis, get_cache, set_cache
+
+# Взвешенный tsvector: название важнее автора, автор важнее жанра. Выражение
+# в запросе должно буквально совпадать с выражением индекса ix_books_search_tsv
+_PG_VECTOR = ("(setweight(to_tsvector('simple', title), 'A') || "
+              "setweight(to_tsvector('simple', author), 'B') || "
+              "setweight(to_tsvector('simple', genre), 'C'))")
+# Текст для нечёткого поиска по триграммам (опечатки в названии и авторе)
+_PG_TRGM_TEXT = "(lower(title || ' ' || author))"
+
+_PG_INDEX_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_books_search_tsv ON books USING GIN ({_PG_VECTOR})",
+    f"CREATE INDEX IF NOT EXISTS ix_books_search_trgm ON books USING GIN ({_PG_TRGM_TEXT} gin_trgm_ops)",
+)
+
+# SQLite: внешний FTS5-индекс по books, синхронизируемый триггерами
+_SQLITE_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE books_fts USING fts5(title, author, genre, content='books', "
+    "content_rowid='book_id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER books_fts_ai AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, author, genre) VALUES (new.book_id, new.title, new.author, new.genre); "
+    "END",
+    "CREATE TRIGGER books_fts_ad AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, genre) "
+    "VALUES ('delete', old.book_id, old.title, old.author, old.genre); "
+    "END",
+    "CREATE TRIGGER books_fts_au AFTER UPDATE OF title, author, genre ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, genre) "
+    "VALUES ('delete', old.book_id, old.title, old.author, old.genre); "
+    "INSERT INTO books_fts(rowid, title, author, genre) VALUES (new.book_id, new.title, new.author, new.genre); "
+    "END",
+    "INSERT INTO books_fts(books_fts) VALUES ('rebuild')",
+)
+
+_SQLITE_SEARCH = text(
+    "SELECT books.* FROM books_fts JOIN books ON books.book_id = books_fts.rowid "
+    "WHERE books_fts MATCH :match "
+    "ORDER BY bm25(books_fts, 10.0, 5.0, 1.0), books.book_id "
+    "LIMIT :limit OFFSET :offset"
+)
+
+
+def ensure_search_index():
+    """Создание поисковых индексов каталога для текущего диалекта"""
+    dialect = db.engine.dialect.name
+    with db.engine.begin() as conn:
+        if dialect == 'postgresql':
+            for statement in _PG_INDEX_DDL:
+                conn.exec_driver_sql(statement)
+        elif dialect == 'sqlite':
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+            ).first()
+            if exists is None:
+                for statement in _SQLITE_INDEX_DDL:
+                    conn.exec_driver_sql(statement)
+
+
+def normalize_query(q):
+    """Нормализация поисковой строки: регистр и пробелы не влияют на ключ кэша"""
+    return ' '.join((q or '').lower().split())
+
+
+def _search_postgres(q, limit, offset):
+    query = func.websearch_to_tsquery('simple', q)
+    vector = literal_column(_PG_VECTOR)
+    trgm_text = literal_column(_PG_TRGM_TEXT)
+    score = func.ts_rank_cd(vector, query) + func.word_similarity(q, trgm_text)
+    stmt = (
+        select(Book)
+        .where(or_(vector.op('@@')(query), literal(q).op('<%')(trgm_text)))
+        .order_by(score.desc(), Book.book_id)
+        .offset(offset)
+        .limit(limit)
+    )
+    return db.session.execute(stmt).scalars().all()
+
+
+def _fts5_match(q):
+    # Каждое слово — префиксный терм в кавычках: синтаксис FTS5 из запроса не интерпретируется
+    terms = [term for term in re.split(r'\W+', q) if term]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _search_sqlite(q, limit, offset):
+    match = _fts5_match(q)
+    if not match:
+        return []
+    stmt = select(Book).from_statement(_SQLITE_SEARCH)
+    return db.session.execute(stmt, {"match": match, "limit": limit, "offset": offset}).scalars().all()
+
+
+def _search_like(q, limit, offset):
+    pattern = f"%{q}%"
+    stmt = (
+        select(Book)
+        .where(or_(Book.title.ilike(pattern), Book.author.ilike(pattern), Book.genre.ilike(pattern)))
+        .order_by(Book.title, Book.book_id)
+        .offset(offset)
+        .limit(limit)
+    )
+    return db.session.execute(stmt).scalars().all()
+
+
+def search_books(q, limit, offset=0):
+    """Ранжированный поиск по названию, автору и жанру: (книги, next_cursor).
+
+    Postgres: полнотекстовый поиск плюс триграммное сходство для опечаток.
+    SQLite: FTS5 с префиксными термами и ранжированием bm25.
+    next_cursor — смещение следующей страницы; глубина выдачи ограничена
+    SEARCH_MAX_RESULTS.
+    """
+    dialect = db.engine.dialect.name
+    search = {'postgresql': _search_postgres, 'sqlite': _search_sqlite}.get(dialect, _search_like)
+    books = search(q, limit + 1, offset)
+
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        if offset + limit < current_app.config['SEARCH_MAX_RESULTS']:
+            next_cursor = offset + limit
+    return [book.to_dict() for book in books], next_cursor
+
+
+def _with_availability(page):
+    # Свободные экземпляры меняются при каждой аренде, поэтому в кэш не попадают
+    ids = [book["book_id"] for book in page["books"]]
+    if ids:
+        available = dict(db.session.execute(
+            select(Book.book_id, Book.available_copies).where(Book.book_id.in_(ids))
+        ).all())
+        for book in page["books"]:
+            book["available_copies"] = available.get(book["book_id"], 0)
+    return current_app.json.dumps(page).encode('utf-8')
+
+
+def get_search_page(q, limit, offset=0):
+    """Страница результатов поиска; кэшируются только популярные запросы.
+
+    Запрос считается популярным, если за окно SEARCH_POPULAR_WINDOW секунд
+    он повторился SEARCH_POPULAR_MIN_HITS раз: редкие запросы не вытесняют
+    из кэша полезные записи. Ключ входит в версию поиска, которая меняется
+    только с составом каталога; available_copies подставляется из БД одним
+    запросом по первичному ключу.
+    """
+    digest = hashlib.sha1(f"{q}|{limit}|{offset}".encode('utf-8')).hexdigest()
+    key = f"search:v{get_search_version()}:{digest}"
+    page = get_cache(key)
+    if page is not None:
+        return _with_availability(page)
+
+    books, next_cursor = search_books(q, limit, offset)
+    page = {"books": books, "next_cursor": next_cursor}
+    hits_key = f"search:hits:{digest}"
+    pipe = get_redis().pipeline()
+    pipe.incr(hits_key)
+    pipe.expire(hits_key, current_app.config['SEARCH_POPULAR_WINDOW'])
+    hits, _ = pipe.execute()
+    if hits >= current_app.config['SEARCH_POPULAR_MIN_HITS']:
+        cached_page = {
+            "books": [{field: value for field, value in book.items() if field != 'available_copies'}
+                      for book in books],
+            "next_cursor": next_cursor
+        }
+        set_cache(key, cached_page, current_app.config['SEARCH_CACHE_TIMEOUT'])
+    return current_app.json.dumps(page).encode('utf-8')
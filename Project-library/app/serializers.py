@@ -1,79 +1,147 @@
-from flask import Response
 import json
+import struct
+import zlib
+from datetime import date, datetime
+from flask import Response, current_app
 
+try:
+    import msgpack
+except ImportError:  # msgpack нужен только для CACHE_CODEC = 'msgpack'
+    msgpack = None
 
-def is_json_serializable(obj):
-    """Проверка, может ли объект быть сериализован в JSON."""
-    try:
-        json.dumps(obj)
-        return True
-    except (TypeError, OverflowError):
-        return False
-
-
-def serialize_for_cache(obj):
-    """Подготовка объекта для кэширования."""
-    # Проверка для ответа Flask
-    if isinstance(obj, Response):
-        return {
-            '_type': 'flask_response',
-            'status_code': obj.status_code,
-            'data': obj.get_data(as_text=True),
-            'headers': dict(obj.headers),
-            'mimetype': obj.mimetype,
-            'direct_passthrough': obj.direct_passthrough
-        }
-
-    # Проверка для списков и словарей с вложенными неподдерживаемыми объектами
-    elif isinstance(obj, dict):
-        result = {}
-        for key, value in obj.items():
-            if is_json_serializable(value):
-                result[key] = value
-            else:
-                result[key] = serialize_for_cache(value)
-        return result
-
-    elif isinstance(obj, list):
-        result = []
-        for item in obj:
-            if is_json_serializable(item):
-                result.append(item)
-            else:
-                result.append(serialize_for_cache(item))
-        return result
-
-    # Для других неподдерживаемых типов - преобразование в строку
-    elif not is_json_serializable(obj):
-        return str(obj)
-
-    # Для поддерживаемых типов - возврат без изменения
-    return obj
-
-
-def deserialize_from_cache(obj):
-    """Восстановление объекта из кэша."""
-    from flask import Response
-
-    if isinstance(obj, dict) and obj.get('_type') == 'flask_response':
-        return Response(
-            response=obj['data'],
-            status=obj['status_code'],
-            headers=obj['headers'],
-            mimetype=obj['mimetype'],
-            direct_passthrough=obj['direct_passthrough']
-        )
-
-    elif isinstance(obj, dict):
-        result = {}
-        for key, value in obj.items():
-            result[key] = deserialize_from_cache(value)
-        return result
-
-    elif isinstance(obj, list):
-        result = []
-        for item in obj:
-            result.append(deserialize_from_cache(item))
-        return result
-
-    return obj
\ No newline at end of file
+# Формат записи в кэше: MAGIC, id кодека, флаги, затем полезная нагрузка
+MAGIC = 0xCA
+FLAG_COMPRESSED = 0x01
+FLAG_RESPONSE = 0x02
+_HEADER = struct.Struct('>BBB')
+_META_LENGTH = struct.Struct('>I')
+
+
+def _default(obj):
+    """Однопроходное преобразование типов, которые кодек не знает.
+
+    Вызывается самим кодировщиком только для «чужих» значений, поэтому
+    дерево обходится ровно один раз.
+    """
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+class Codec:
+    """Интерфейс кодека кэша: dumps(obj) -> bytes, loads(bytes) -> obj"""
+    codec_id = None
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    codec_id = 1
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    codec_id = 2
+    name = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("CACHE_CODEC = 'msgpack' requires the msgpack package")
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+CODECS = {codec.name: codec for codec in (JSONCodec, MsgpackCodec)}
+
+
+class CacheSerializer:
+    """Кодирование значений для кэша с опциональным сжатием zlib.
+
+    Ответы Flask хранятся как готовые байты тела плюс статус и заголовки,
+    без повторного кодирования тела. Каждая запись несёт id кодека, поэтому
+    смена CACHE_CODEC не ломает чтение уже сохранённых записей.
+    """
+
+    def __init__(self, codec='json', compress_threshold=None, compress_level=6):
+        self.codec = CODECS[codec]()
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self._codecs = {self.codec.codec_id: self.codec}
+
+    def dumps(self, obj):
+        flags = 0
+        if isinstance(obj, tuple) and obj and isinstance(obj[0], Response):
+            # (response, status[, headers]) из view-функции
+            obj = current_app.make_response(obj)
+        if isinstance(obj, Response):
+            flags |= FLAG_RESPONSE
+            meta = self.codec.dumps([obj.status_code, list(obj.headers.items())])
+            payload = _META_LENGTH.pack(len(meta)) + meta + obj.get_data()
+        else:
+            payload = self.codec.dumps(obj)
+
+        if self.compress_threshold and len(payload) >= self.compress_threshold:
+            flags |= FLAG_COMPRESSED
+            payload = zlib.compress(payload, self.compress_level)
+        return _HEADER.pack(MAGIC, self.codec.codec_id, flags) + payload
+
+    def loads(self, data):
+        """Декодирование записи; None для записей неизвестного формата"""
+        if len(data) < _HEADER.size:
+            return None
+        magic, codec_id, flags = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            return None
+        codec = self._get_codec(codec_id)
+        if codec is None:
+            return None
+
+        payload = memoryview(data)[_HEADER.size:]
+        if flags & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        if flags & FLAG_RESPONSE:
+            meta_length, = _META_LENGTH.unpack_from(payload)
+            start = _META_LENGTH.size
+            status_code, headers = codec.loads(bytes(payload[start:start + meta_length]))
+            return Response(response=bytes(payload[start + meta_length:]), status=status_code, headers=headers)
+        return codec.loads(bytes(payload))
+
+    def _get_codec(self, codec_id):
+        codec = self._codecs.get(codec_id)
+        if codec is None:
+            for codec_class in CODECS.values():
+                if codec_class.codec_id == codec_id:
+                    try:
+                        codec = self._codecs[codec_id] = codec_class()
+                    except RuntimeError:
+                        return None
+        return codec
+
+
+def init_serializer(app):
+    app.extensions['cache_serializer'] = CacheSerializer(
+        codec=app.config.get('CACHE_CODEC', 'json'),
+        compress_threshold=app.config.get('CACHE_COMPRESS_THRESHOLD'),
+        compress_level=app.config.get('CACHE_COMPRESS_LEVEL', 6)
+    )
+
+
+def get_serializer():
+    return current_app.extensions['cache_serializer']
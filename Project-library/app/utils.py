@@ -1,5 +1,7 @@
 import jwt
+import uuid
 from datetime import datetime, timedelta
+from flask import current_app
 from .models import User
 
 def checkUser(username, email):
@@ -8,16 +10,41 @@ def checkUser(username, email):
     if User.query.filter_by(email=email).first():
         return True
 
-def generate_access_token(user_id):
-    payload = {
-        'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(minutes=30)  # Токен действует 30 минут
-    }
-    return jwt.encode(payload, 'liba', algorithm='HS256')
+def parse_page_args(args, default_limit, max_limit):
+    """Разбор параметров keyset-пагинации: limit (с ограничением) и cursor"""
+    limit = args.get('limit', default_limit, type=int)
+    limit = max(1, min(limit, max_limit))
+    cursor = args.get('cursor', type=int)
+    return limit, cursor
+
+def parse_bool_arg(value):
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true', 'yes')
 
-def generate_refresh_token(user_id):
+def _encode_token(user_id, role, token_type, lifetime):
+    now = datetime.utcnow()
     payload = {
         'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(days=7)  # Токен действует 7 дней
+        'role': role,
+        'type': token_type,
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + lifetime
     }
-    return jwt.encode(payload, 'liba', algorithm='HS256')
+    return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+
+def generate_access_token(user_id, role=None):
+    return _encode_token(user_id, role, 'access', timedelta(minutes=30))  # Токен действует 30 минут
+
+def generate_refresh_token(user_id, role=None):
+    return _encode_token(user_id, role, 'refresh', timedelta(days=7))  # Токен действует 7 дней
+
+def decode_token(token, token_type):
+    """Проверка подписи и срока действия; jwt.InvalidTokenError при ошибке"""
+    payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+    # Токены без поля type выпускались до его появления и предъявлялись только в /refresh/:
+    # они принимаются как refresh-токены, но не как access-токены
+    if payload.get('type', 'refresh') != token_type:
+        raise jwt.InvalidTokenError(f"Expected a {token_type} token")
+    return payload
@@ -0,0 +1,131 @@
+"""Микробенчмарк кодеков кэша на данных размера дашборда.
+
+Запуск из каталога Project-library:
+
+    python -m benchmarks.codec_bench --books 1000 --repeat 200
+
+Сравнивает прежний serialize_for_cache + json.dumps с JSON- и msgpack-кодеками
+CacheSerializer (со сжатием и без) на словаре каталога и на готовом Response.
+"""
+import argparse
+import json
+import random
+import time
+
+from flask import Flask, Response
+
+from app.serializers import CacheSerializer, msgpack
+
+
+def legacy_is_json_serializable(obj):
+    try:
+        json.dumps(obj)
+        return True
+    except (TypeError, OverflowError):
+        return False
+
+
+def legacy_serialize(obj):
+    """Прежний serialize_for_cache: json.dumps на каждом уровне вложенности"""
+    if isinstance(obj, Response):
+        return {
+            '_type': 'flask_response',
+            'status_code': obj.status_code,
+            'data': obj.get_data(as_text=True),
+            'headers': dict(obj.headers),
+            'mimetype': obj.mimetype,
+            'direct_passthrough': obj.direct_passthrough
+        }
+    elif isinstance(obj, dict):
+        return {key: value if legacy_is_json_serializable(value) else legacy_serialize(value)
+                for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [item if legacy_is_json_serializable(item) else legacy_serialize(item) for item in obj]
+    elif not legacy_is_json_serializable(obj):
+        return str(obj)
+    return obj
+
+
+def legacy_deserialize(obj):
+    if isinstance(obj, dict) and obj.get('_type') == 'flask_response':
+        return Response(response=obj['data'], status=obj['status_code'], headers=obj['headers'],
+                        mimetype=obj['mimetype'], direct_passthrough=obj['direct_passthrough'])
+    elif isinstance(obj, dict):
+        return {key: legacy_deserialize(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [legacy_deserialize(item) for item in obj]
+    return obj
+
+
+class LegacySerializer:
+    def dumps(self, obj):
+        return json.dumps(legacy_serialize(obj)).encode()
+
+    def loads(self, data):
+        return legacy_deserialize(json.loads(data))
+
+
+def make_catalog(books):
+    genres = ['Fantasy', 'Science', 'History', 'Poetry', 'Drama', 'Detective']
+    return {
+        "books": [
+            {
+                "book_id": i,
+                "title": f"Book title number {i}",
+                "author": f"Author {random.randint(1, books // 10 + 1)}",
+                "genre": random.choice(genres),
+                "available_copies": random.randint(0, 5),
+                "total_copies": 5,
+                "rating": {"count": random.randint(0, 500), "average": round(random.uniform(1, 5), 2)}
+            } for i in range(1, books + 1)
+        ],
+        "next_cursor": books
+    }
+
+
+def measure(serializer, value, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        data = serializer.dumps(value)
+    encode = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        serializer.loads(data)
+    decode = (time.perf_counter() - started) / repeat
+    return len(data), encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--compress-threshold', type=int, default=4096)
+    args = parser.parse_args()
+
+    random.seed(42)
+    catalog = make_catalog(args.books)
+    app = Flask(__name__)
+
+    serializers = [('legacy serialize_for_cache', LegacySerializer())]
+    codecs = ['json'] + (['msgpack'] if msgpack is not None else [])
+    for codec in codecs:
+        serializers.append((codec, CacheSerializer(codec)))
+        serializers.append((f"{codec}+zlib", CacheSerializer(codec, args.compress_threshold)))
+
+    with app.app_context():
+        payloads = [
+            ('catalog dict', catalog),
+            ('Response', Response(json.dumps(catalog), mimetype='application/json'))
+        ]
+        print(f"{args.books} books, {args.repeat} iterations"
+              + ("" if msgpack is not None else " (msgpack not installed)"))
+        for payload_name, value in payloads:
+            print(f"\n{payload_name}")
+            print(f"  {'codec':<28}{'size, KB':>10}{'encode, ms':>12}{'decode, ms':>12}")
+            for name, serializer in serializers:
+                size, encode, decode = measure(serializer, value, args.repeat)
+                print(f"  {name:<28}{size / 1024:>10.1f}{encode * 1000:>12.3f}{decode * 1000:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
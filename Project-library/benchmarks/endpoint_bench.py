@@ -0,0 +1,569 @@
+"""Нагрузочный бенчмарк всех эндпоинтов app/routes.py на локальных заменителях.
+
+Запуск из каталога Project-library (pip install -r benchmarks/requirements.txt):
+
+    python -m benchmarks.endpoint_bench --concurrency 16 --duration 3
+    python -m benchmarks.endpoint_bench --only book_detail,search --books 20000
+    python -m benchmarks.endpoint_bench --save-baseline bench-baseline.json
+    python -m benchmarks.endpoint_bench --baseline bench-baseline.json --tolerance 0.25
+
+SQL — файл SQLite во временном каталоге или --database-uri (например,
+локальный Postgres); MongoDB — mongomock, Redis — fakeredis, если не заданы
+--mongo-uri и --redis-url. Данные (книги, пользователи, аренды, отзывы,
+логи) засеиваются в объёмах из аргументов, затем приложение обслуживается
+многопоточным сервером Werkzeug в этом же процессе, и каждый эндпоинт
+нагружается отдельно --concurrency клиентами в течение --duration секунд.
+
+Печатаются запросы в секунду, ошибки и p50/p95/p99 по эндпоинтам. С
+--baseline запуск завершается с кодом 1, если по какому-либо эндпоинту
+пропускная способность упала или p95 вырос больше чем на --tolerance,
+либо появились ответы с неожиданным статусом.
+"""
+import argparse
+import collections
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+from benchmarks import stand_ins
+
+BENCH_PASSWORD = 'bench-password'
+WORDS = ('river', 'shadow', 'garden', 'winter', 'silver', 'empire', 'night', 'ocean', 'stone', 'crown',
+         'forest', 'mirror', 'storm', 'glass', 'city', 'dragon', 'letter', 'island', 'fire', 'road')
+AUTHORS = ('Tolstoy', 'Austen', 'Orwell', 'Bulgakov', 'Le Guin', 'Pratchett', 'Borges', 'Murakami',
+           'Christie', 'Dostoevsky', 'Woolf', 'Chekhov')
+GENRES = ('fantasy', 'sci-fi', 'drama', 'detective', 'poetry', 'history', 'romance', 'horror')
+LOG_ACTIONS = ('rent_book', 'return_book', 'add_review', 'view_dashboard')
+# Параметры запуска, при различии которых сравнение с базовой линией некорректно
+RUN_PARAMS = ('books', 'users', 'rentals', 'reviews', 'logs', 'rollup_logs', 'concurrency')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def build_app(args):
+    database_uri = args.database_uri
+    if not database_uri:
+        database_uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'endpoint_bench.sqlite')
+    config = {'SQLALCHEMY_DATABASE_URI': database_uri}
+    if database_uri.startswith('sqlite'):
+        # Клиенты и пул потоков карточки книги держат соединения одновременно
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'connect_args': {'timeout': 30, 'check_same_thread': False},
+            'pool_size': args.concurrency * 2,
+            'max_overflow': args.concurrency * 2
+        }
+    if args.mongo_uri:
+        config['MONGO_URI'] = args.mongo_uri
+    else:
+        stand_ins.install_mongo()
+    if args.redis_url:
+        config['REDIS_URL'] = args.redis_url
+    else:
+        stand_ins.install_redis()
+
+    from app import create_app
+    return create_app(config), database_uri
+
+
+def seed(app, args, rng):
+    """Заполнение баз и прогрев производных данных (сводки оценок, рейтинг, сводки активности)"""
+    from sqlalchemy import insert
+    from app import db, mongo
+    from app.models import User, Book, Rental
+    from app.models_mongo import LogEntry, RatingSummary, JobCheckpoint
+    from app.rentals import due_date_for
+    from app.popularity import rebuild_popularity
+    from app.rollups import rollup_activity, ROLLUP_JOB_ID
+    from app.utils import generate_access_token, generate_refresh_token
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(BENCH_PASSWORD, 'pbkdf2:sha256')
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {"username": f"bench_reader_{i}", "password_hash": password_hash,
+             "email": f"bench_reader_{i}@bench", "role": "reader"}
+            for i in range(args.users)
+        ] + [{"username": "bench_admin", "password_hash": password_hash, "email": "bench_admin@bench", "role": "admin"}])
+        for start in range(0, args.books, 1000):
+            db.session.execute(insert(Book), [
+                {"title": f"{' '.join(rng.sample(WORDS, 2)).title()} {i}", "author": rng.choice(AUTHORS),
+                 "genre": rng.choice(GENRES), "total_copies": args.copies, "available_copies": args.copies}
+                for i in range(start, min(start + 1000, args.books))
+            ])
+        db.session.commit()
+        users = db.session.execute(db.select(User.user_id, User.username, User.role)).all()
+        book_ids = db.session.execute(db.select(Book.book_id)).scalars().all()
+        readers = [(user_id, username) for user_id, username, role in users if role == 'reader']
+        admin_id = next(user_id for user_id, _, role in users if role == 'admin')
+
+        # Закрытые аренды: история пользователей и рейтинг популярности
+        for start in range(0, args.rentals, 1000):
+            rows = []
+            for _ in range(min(1000, args.rentals - start)):
+                rental_date = now - timedelta(days=rng.randint(1, 60), minutes=rng.randint(0, 1439))
+                rows.append({"user_id": rng.choice(readers)[0], "book_id": rng.choice(book_ids),
+                             "rental_date": rental_date, "due_date": due_date_for(rental_date),
+                             "return_date": rental_date + timedelta(days=rng.randint(1, 20))})
+            db.session.execute(insert(Rental), rows)
+        db.session.commit()
+
+        reviews = [
+            {"user_id": rng.choice(readers)[0], "book_id": rng.choice(book_ids), "rating": rng.randint(1, 5),
+             "review_text": f"Bench review {i}", "created_at": now - timedelta(minutes=i),
+             "updated_at": now - timedelta(minutes=i)}
+            for i in range(args.reviews)
+        ]
+        if reviews:
+            mongo.db.book_reviews.insert_many(reviews)
+        RatingSummary.recompute()
+
+        entries = []
+        for _ in range(args.logs):
+            entry = LogEntry.build(rng.choice(LOG_ACTIONS), user_id=rng.choice(readers)[0],
+                                   book_id=rng.choice(book_ids))
+            entry["_id"] = ObjectId()
+            entry["timestamp"] = now - timedelta(seconds=rng.randint(120, 7 * 86400))
+            entries.append(entry)
+        for start in range(0, len(entries), 5000):
+            mongo.db.logs.insert_many(entries[start:start + 5000])
+
+        # В сводки сворачиваются только последние rollup_logs записей: upsert в mongomock
+        # просматривает всю коллекцию, и полная свёртка заняла бы большую часть засева
+        entries.sort(key=lambda entry: (entry["timestamp"], entry["_id"]))
+        if 0 <= args.rollup_logs < len(entries):
+            mark = entries[len(entries) - args.rollup_logs - 1]
+            JobCheckpoint.save(ROLLUP_JOB_ID, last_timestamp=mark["timestamp"], last_id=mark["_id"], rows=0)
+
+        rebuild_popularity()
+        rollup_activity()
+
+        tokens = {user_id: generate_access_token(user_id, 'reader') for user_id, _ in readers}
+        context = BenchContext(
+            app=app,
+            readers=readers,
+            reader_tokens=tokens,
+            admin_id=admin_id,
+            admin_token=generate_access_token(admin_id, 'admin'),
+            refresh_token=generate_refresh_token(readers[0][0], 'reader'),
+            book_ids=book_ids
+        )
+    print(f"seeded {args.books} books, {args.users} users, {args.rentals} rentals, {args.reviews} reviews, "
+          f"{args.logs} log entries in {time.perf_counter() - started:.1f}s")
+    return context
+
+
+class BenchContext:
+    """Засеянные данные и общее состояние клиентов (открытые аренды для возврата)"""
+
+    def __init__(self, app, readers, reader_tokens, admin_id, admin_token, refresh_token, book_ids):
+        self.app = app
+        self.readers = readers
+        self.reader_tokens = reader_tokens
+        self.admin_id = admin_id
+        self.admin_token = admin_token
+        self.refresh_token = refresh_token
+        self.book_ids = book_ids
+        self.open_rentals = collections.deque()
+        self.counter = itertools.count()
+        self.port = None
+
+    def reader(self, rng):
+        user_id, username = rng.choice(self.readers)
+        return user_id, username, self.reader_tokens[user_id]
+
+    def fresh_token(self, user_id, role='reader'):
+        from app.utils import generate_access_token
+        with self.app.app_context():
+            return generate_access_token(user_id, role)
+
+
+def request(port, method, path, body=None, headers=None, timeout=30):
+    """Один HTTP-запрос; статус ответа или None при сетевой ошибке"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        data = response.read()
+        return response.status, data
+    except (OSError, http.client.HTTPException):
+        return None, b''
+    finally:
+        connection.close()
+
+
+def bearer(token, content_type=None):
+    headers = {'Authorization': f'Bearer {token}'}
+    if content_type:
+        headers['Content-Type'] = content_type
+    return headers
+
+
+def as_json(payload):
+    return json.dumps(payload).encode('utf-8')
+
+
+# Сценарии: функция (ctx, rng) -> (method, path, body, headers[, done(status)]) и ожидаемые статусы
+
+def s_index(ctx, rng):
+    return 'GET', '/', None, {}
+
+
+def s_register(ctx, rng):
+    name = f"bench_new_{os.getpid()}_{next(ctx.counter)}"
+    body = {"username": name, "password": BENCH_PASSWORD, "email": f"{name}@bench", "role": "reader"}
+    return 'POST', '/register/', as_json(body), {'Content-Type': 'application/json'}
+
+
+def s_login(ctx, rng):
+    _, username, _ = ctx.reader(rng)
+    body = {"username": username, "password": BENCH_PASSWORD}
+    return 'POST', '/login/', as_json(body), {'Content-Type': 'application/json'}
+
+
+def s_logout(ctx, rng):
+    # Выход отзывает токен, поэтому у каждого запроса свой
+    user_id, _, _ = ctx.reader(rng)
+    return 'POST', '/logout/', None, bearer(ctx.fresh_token(user_id))
+
+
+def s_refresh(ctx, rng):
+    return 'POST', '/refresh/', as_json({"refresh_token": ctx.refresh_token}), {'Content-Type': 'application/json'}
+
+
+def s_dashboard_reader(ctx, rng):
+    _, _, token = ctx.reader(rng)
+    path = '/dashboard/' if rng.random() < 0.5 else f"/dashboard/?genre={rng.choice(GENRES)}&limit=50"
+    return 'GET', path, None, bearer(token)
+
+
+def s_dashboard_admin(ctx, rng):
+    return 'GET', f"/dashboard/?cursor={rng.choice(ctx.book_ids)}&with_ratings=true", None, bearer(ctx.admin_token)
+
+
+def s_search(ctx, rng):
+    q = rng.choice(WORDS) if rng.random() < 0.7 else f"{rng.choice(WORDS)} {rng.choice(WORDS)}"
+    return 'GET', f"/books/search/?q={q.replace(' ', '+')}", None, {}
+
+
+def s_popular(ctx, rng):
+    return 'GET', rng.choice(('/books/popular/', '/books/popular/?days=7', '/books/popular/?days=30')), None, {}
+
+
+def s_add_book(ctx, rng):
+    body = {"title": f"New {rng.choice(WORDS)} {next(ctx.counter)}", "author": rng.choice(AUTHORS),
+            "genre": rng.choice(GENRES), "total_copies": 10}
+    return 'POST', '/add_book/', as_json(body), bearer(ctx.admin_token, 'application/json')
+
+
+def s_import_books(ctx, rng):
+    batch = next(ctx.counter)
+    lines = ['title,author,genre,total_copies'] + [
+        f"Imported {rng.choice(WORDS)} {batch}-{i},{rng.choice(AUTHORS)},{rng.choice(GENRES)},5" for i in range(20)
+    ]
+    body = ('\n'.join(lines) + '\n').encode('utf-8')
+    return 'POST', '/admin/books/import/?format=csv', body, bearer(ctx.admin_token, 'text/csv')
+
+
+def s_rent_book(ctx, rng):
+    user_id, _, token = ctx.reader(rng)
+    book_id = rng.choice(ctx.book_ids)
+
+    def done(status):
+        # Успешные аренды возвращаются в фазе return_book
+        if status == 200:
+            ctx.open_rentals.append((user_id, book_id))
+    return 'POST', f"/rent_book/{book_id}/", None, bearer(token), done
+
+
+def s_return_book(ctx, rng):
+    try:
+        user_id, book_id = ctx.open_rentals.popleft()
+    except IndexError:
+        # Аренды кончились: берём книгу запросом вне замера
+        user_id, _, token = ctx.reader(rng)
+        book_id = rng.choice(ctx.book_ids)
+        request(ctx.port, 'POST', f"/rent_book/{book_id}/", headers=bearer(token))
+    return 'POST', f"/book/{book_id}/return/", None, bearer(ctx.reader_tokens[user_id])
+
+
+def s_rentals_batch(ctx, rng):
+    _, _, token = ctx.reader(rng)
+    body = {"action": "rent", "book_ids": rng.sample(ctx.book_ids, min(3, len(ctx.book_ids)))}
+    return 'POST', '/rentals/batch/', as_json(body), bearer(token, 'application/json')
+
+
+def s_book_detail(ctx, rng):
+    return 'GET', f"/book/{rng.choice(ctx.book_ids)}/", None, bearer(ctx.reader(rng)[2])
+
+
+def s_book_reviews(ctx, rng):
+    return 'GET', f"/book/{rng.choice(ctx.book_ids)}/reviews/?limit=20", None, bearer(ctx.reader(rng)[2])
+
+
+def s_book_rating(ctx, rng):
+    return 'GET', f"/book/{rng.choice(ctx.book_ids)}/rating/", None, bearer(ctx.reader(rng)[2])
+
+
+def s_add_review(ctx, rng):
+    body = {"rating": rng.randint(1, 5), "review_text": "Bench review"}
+    return 'POST', f"/book/{rng.choice(ctx.book_ids)}/review/", as_json(body), \
+        bearer(ctx.reader(rng)[2], 'application/json')
+
+
+def s_user_activity(ctx, rng):
+    return 'GET', '/user/activity/', None, bearer(ctx.reader(rng)[2])
+
+
+def s_user_rentals(ctx, rng):
+    status = rng.choice(('open', 'closed', 'all'))
+    return 'GET', f"/user/rentals/?status={status}", None, bearer(ctx.reader(rng)[2])
+
+
+def s_admin_metrics(ctx, rng):
+    return 'GET', '/admin/metrics/', None, bearer(ctx.admin_token)
+
+
+def s_logs_export(ctx, rng):
+    start = (datetime.utcnow() - timedelta(hours=1)).isoformat(timespec='seconds')
+    compress = '&compress=gzip' if rng.random() < 0.5 else ''
+    return 'GET', f"/admin/logs/export/?start={start}{compress}", None, bearer(ctx.admin_token)
+
+
+def s_stats(ctx, rng):
+    path = rng.choice(('/stats/', '/stats/?dimension=genre', '/stats/?dimension=book&granularity=day&limit=20'))
+    return 'GET', path, None, bearer(ctx.admin_token)
+
+
+SCENARIOS = (
+    ('index', s_index, (200,)),
+    ('register', s_register, (201,)),
+    ('login', s_login, (200,)),
+    ('logout', s_logout, (200,)),
+    ('refresh', s_refresh, (200,)),
+    ('dashboard_reader', s_dashboard_reader, (200,)),
+    ('dashboard_admin', s_dashboard_admin, (200,)),
+    ('search', s_search, (200,)),
+    ('popular', s_popular, (200,)),
+    ('add_book', s_add_book, (201,)),
+    ('import_books', s_import_books, (200,)),
+    ('rent_book', s_rent_book, (200,)),
+    ('return_book', s_return_book, (200,)),
+    ('rentals_batch', s_rentals_batch, (200,)),
+    ('book_detail', s_book_detail, (200,)),
+    ('book_reviews', s_book_reviews, (200,)),
+    ('book_rating', s_book_rating, (200,)),
+    ('add_review', s_add_review, (201,)),
+    ('user_activity', s_user_activity, (200,)),
+    ('user_rentals', s_user_rentals, (200,)),
+    ('admin_metrics', s_admin_metrics, (200,)),
+    ('logs_export', s_logs_export, (200,)),
+    ('stats', s_stats, (200,)),
+)
+
+
+def run_phase(ctx, build, expected, concurrency, duration, warmup, min_requests, seed):
+    """Нагрузка одного эндпоинта: concurrency клиентов, замер после warmup секунд.
+
+    В замер входят запросы, начатые после прогрева; каждый клиент делает не
+    меньше min_requests / concurrency таких запросов, даже если --duration
+    уже истекла, поэтому у медленных эндпоинтов остаётся выборка для
+    перцентилей. rps считается по фактическому интервалу замера.
+    """
+    lock = threading.Lock()
+    latencies = []
+    statuses = collections.Counter()
+    finished = [0.0]
+    per_client = -(-min_requests // concurrency)
+    record_from = time.monotonic() + warmup
+    deadline = record_from + duration
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        local_latencies = []
+        local_statuses = collections.Counter()
+        while time.monotonic() < deadline or len(local_latencies) < per_client:
+            method, path, body, headers, *done = build(ctx, rng)
+            measured = time.monotonic() >= record_from
+            started = time.perf_counter()
+            status, _ = request(ctx.port, method, path, body, headers)
+            elapsed = time.perf_counter() - started
+            if done:
+                done[0](status)
+            if measured:
+                local_latencies.append(elapsed)
+                local_statuses[status] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+            finished[0] = max(finished[0], time.monotonic())
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    window = max(finished[0] - record_from, 1e-9)
+    errors = sum(count for status, count in statuses.items() if status not in expected)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        "rps": round(len(latencies) / window, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2)
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Регрессии относительно базовой линии: список строк с описанием"""
+    regressions = []
+    for name, current in results["endpoints"].items():
+        if current["errors"]:
+            regressions.append(f"{name}: {current['errors']} unexpected responses {current['statuses']}")
+        base = baseline["endpoints"].get(name)
+        if base is None:
+            continue
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['rps']} rps < baseline {base['rps']} rps")
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms > baseline {base['p95_ms']} ms")
+    return regressions
+
+
+def print_table(results, baseline=None):
+    header = f"{'endpoint':<18} {'requests':>8} {'errors':>6} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    if baseline:
+        header += f" {'rps vs base':>12}"
+    print(header)
+    for name, row in results["endpoints"].items():
+        line = (f"{name:<18} {row['requests']:>8} {row['errors']:>6} {row['rps']:>9.1f} "
+                f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+        base = (baseline or {}).get("endpoints", {}).get(name)
+        if base and base["rps"]:
+            line += f" {(row['rps'] / base['rps'] - 1) * 100:>+11.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-uri', default=os.environ.get('BENCH_DATABASE_URI'))
+    parser.add_argument('--mongo-uri', default=os.environ.get('BENCH_MONGO_URI'),
+                        help='Real MongoDB instead of mongomock')
+    parser.add_argument('--redis-url', default=os.environ.get('BENCH_REDIS_URL'),
+                        help='Real Redis instead of fakeredis')
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rentals', type=int, default=5000, help='closed rentals in the history')
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--logs', type=int, default=5000, help='activity log entries')
+    parser.add_argument('--rollup-logs', type=int, default=500,
+                        help='most recent log entries folded into activity rollups (-1: all)')
+    parser.add_argument('--copies', type=int, default=100000, help='copies of every book')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=3.0, help='measured seconds per endpoint')
+    parser.add_argument('--warmup', type=float, default=0.5, help='unmeasured seconds per endpoint')
+    parser.add_argument('--min-requests', type=int, default=20,
+                        help='measured requests per endpoint even if --duration has passed')
+    parser.add_argument('--only', default=None, help='comma-separated endpoint names')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='write results as JSON')
+    parser.add_argument('--baseline', default=None, help='fail on regressions against this results file')
+    parser.add_argument('--save-baseline', default=None, help='write results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative drop of rps / growth of p95 against the baseline')
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if args.only:
+        names = set(args.only.split(','))
+        unknown = names - {name for name, _, _ in SCENARIOS}
+        if unknown:
+            parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+        scenarios = [scenario for scenario in SCENARIOS if scenario[0] in names]
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+    app, database_uri = build_app(args)
+    ctx = seed(app, args, rng)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    ctx.port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    backends = {
+        "database": database_uri.split(':')[0],
+        "mongo": 'mongodb' if args.mongo_uri else 'mongomock',
+        "redis": 'redis' if args.redis_url else 'fakeredis'
+    }
+    print(f"concurrency={args.concurrency} duration={args.duration}s/endpoint "
+          + ' '.join(f"{key}={value}" for key, value in backends.items()))
+
+    results = {
+        "meta": dict(
+            {key: getattr(args, key) for key in RUN_PARAMS}, **backends,
+            duration=args.duration,
+            python=platform.python_version(),
+            machine=platform.machine(),
+            created_at=datetime.utcnow().isoformat(timespec='seconds')
+        ),
+        "endpoints": {}
+    }
+    try:
+        for index, (name, build, expected) in enumerate(scenarios):
+            results["endpoints"][name] = run_phase(ctx, build, expected, args.concurrency, args.duration,
+                                                   args.warmup, args.min_requests, args.seed + index)
+            row = results["endpoints"][name]
+            print(f"  {name}: {row['rps']} rps, p95 {row['p95_ms']} ms, errors {row['errors']}", flush=True)
+    finally:
+        server.shutdown()
+
+    print()
+    print_table(results, baseline)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write('\n')
+
+    if baseline is not None:
+        differing = [key for key in RUN_PARAMS + ('database', 'mongo', 'redis')
+                     if baseline.get("meta", {}).get(key) != results["meta"][key]]
+        if differing:
+            print(f"warning: baseline was recorded with different {', '.join(differing)}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nno regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
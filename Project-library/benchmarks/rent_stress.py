@@ -0,0 +1,207 @@
+"""Стресс-тест аренды/возврата одной книги из множества потоков.
+
+Запуск из каталога Project-library:
+
+    python -m benchmarks.rent_stress --threads 32 --attempts 50 --copies 500
+    python -m benchmarks.rent_stress --mode naive   # старый read-modify-write
+
+По умолчанию используется SQLite-файл во временном каталоге; для Postgres
+передайте --database-uri или переменную окружения BENCH_DATABASE_URI.
+MongoDB и Redis не требуются: тест работает напрямую с моделями.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db
+from app.models import User, Book, Rental
+
+
+def rent_atomic(user_id, book_id):
+    if Book.checkout(book_id) is None:
+        db.session.rollback()
+        return False
+    db.session.add(Rental(user_id=user_id, book_id=book_id, rental_date=datetime.utcnow()))
+    db.session.commit()
+    return True
+
+
+def rent_naive(user_id, book_id):
+    db.session.expire_all()
+    book = db.session.get(Book, book_id)
+    if book.available_copies <= 0:
+        db.session.rollback()
+        return False
+    book.available_copies -= 1
+    db.session.add(Rental(user_id=user_id, book_id=book_id, rental_date=datetime.utcnow()))
+    db.session.commit()
+    return True
+
+
+def return_atomic(user_id, book_id):
+    if Rental.close_open(user_id, book_id, datetime.utcnow()) is None:
+        db.session.rollback()
+        return False
+    Book.checkin(book_id)
+    db.session.commit()
+    return True
+
+
+def return_naive(user_id, book_id):
+    db.session.expire_all()
+    rental = Rental.query.filter_by(user_id=user_id, book_id=book_id, return_date=None).first()
+    if rental is None:
+        db.session.rollback()
+        return False
+    rental.return_date = datetime.utcnow()
+    book = db.session.get(Book, book_id)
+    book.available_copies += 1
+    db.session.commit()
+    return True
+
+
+STRATEGIES = {
+    'atomic': (rent_atomic, return_atomic),
+    'naive': (rent_naive, return_naive),
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_phase(app, operation, user_ids, book_id, attempts):
+    """Параллельный запуск operation из len(user_ids) потоков"""
+    barrier = threading.Barrier(len(user_ids))
+    lock = threading.Lock()
+    stats = {"ok": 0, "rejected": 0, "errors": 0, "latencies": []}
+
+    def worker(user_id):
+        ok = rejected = errors = 0
+        latencies = []
+        with app.app_context():
+            barrier.wait()
+            for _ in range(attempts):
+                started = time.perf_counter()
+                try:
+                    if operation(user_id, book_id):
+                        ok += 1
+                    else:
+                        rejected += 1
+                except OperationalError:
+                    # SQLite отвечает "database is locked" при конфликте блокировок
+                    db.session.rollback()
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+        with lock:
+            stats["ok"] += ok
+            stats["rejected"] += rejected
+            stats["errors"] += errors
+            stats["latencies"].extend(latencies)
+
+    threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats["elapsed"] = time.perf_counter() - started
+    return stats
+
+
+def report(name, stats):
+    total = stats["ok"] + stats["rejected"] + stats["errors"]
+    latencies = stats["latencies"]
+    print(f"{name}: {total} ops in {stats['elapsed']:.2f}s "
+          f"({total / stats['elapsed']:.0f} ops/s), ok={stats['ok']} "
+          f"rejected={stats['rejected']} errors={stats['errors']}, "
+          f"p50={percentile(latencies, 50) * 1000:.1f}ms "
+          f"p99={percentile(latencies, 99) * 1000:.1f}ms")
+
+
+def book_state(app, book_id):
+    with app.app_context():
+        book = db.session.get(Book, book_id)
+        open_rentals = Rental.query.filter_by(book_id=book_id, return_date=None).count()
+        return book.available_copies, book.total_copies, open_rentals
+
+
+def check(label, condition, failures):
+    print(f"  [{'ok' if condition else 'FAIL'}] {label}")
+    if not condition:
+        failures.append(label)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-uri', default=os.environ.get('BENCH_DATABASE_URI'))
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=50, help='rent attempts per thread')
+    parser.add_argument('--copies', type=int, default=200)
+    parser.add_argument('--mode', choices=sorted(STRATEGIES), default='atomic')
+    args = parser.parse_args()
+
+    database_uri = args.database_uri
+    if not database_uri:
+        database_uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'rent_stress.sqlite')
+    engine_options = {}
+    if database_uri.startswith('sqlite'):
+        engine_options = {'connect_args': {'timeout': 30}}
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options,
+        'LOG_WRITER_ENABLED': False,
+        'MONGO_ENSURE_INDEXES': False
+    })
+
+    with app.app_context():
+        users = [
+            User(username=f'stress_{i}_{time.time_ns()}', password_hash='-',
+                 email=f'stress_{i}_{time.time_ns()}@bench', role='reader')
+            for i in range(args.threads)
+        ]
+        book = Book(title='Stress test', author='Bench', genre='bench',
+                    available_copies=args.copies, total_copies=args.copies)
+        db.session.add_all(users + [book])
+        db.session.commit()
+        user_ids = [user.user_id for user in users]
+        book_id = book.book_id
+
+    rent, give_back = STRATEGIES[args.mode]
+    print(f"mode={args.mode} threads={args.threads} attempts/thread={args.attempts} "
+          f"copies={args.copies} db={database_uri}")
+
+    failures = []
+    rent_stats = run_phase(app, rent, user_ids, book_id, args.attempts)
+    report('rent', rent_stats)
+    available, total, open_rentals = book_state(app, book_id)
+    check(f"available_copies >= 0 ({available})", available >= 0, failures)
+    check(f"open rentals == total - available ({open_rentals} == {total - available})",
+          open_rentals == total - available, failures)
+    check(f"successful rents == open rentals ({rent_stats['ok']} == {open_rentals})",
+          rent_stats['ok'] == open_rentals, failures)
+
+    return_stats = run_phase(app, give_back, user_ids, book_id, args.attempts)
+    report('return', return_stats)
+    available, total, open_rentals = book_state(app, book_id)
+    check(f"open rentals == total - available ({open_rentals} == {total - available})",
+          open_rentals == total - available, failures)
+    check(f"available_copies <= total_copies ({available} <= {total})", available <= total, failures)
+
+    if failures:
+        print(f"{len(failures)} invariant(s) violated")
+        sys.exit(1)
+    print("all invariants hold")
+
+
+if __name__ == '__main__':
+    main()
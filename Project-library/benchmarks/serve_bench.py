@@ -0,0 +1,129 @@
+"""Сравнение пропускной способности dev-сервера Werkzeug и gunicorn.
+
+Запуск из каталога Project-library при поднятых Postgres, MongoDB и Redis
+(например, docker-compose up db mongo redis):
+
+    python -m benchmarks.serve_bench --concurrency 32 --duration 10
+    python -m benchmarks.serve_bench --servers gunicorn --workers 4 --threads 8
+
+Каждый сервер запускается отдельным процессом на свободном порту, затем
+заданное число клиентских потоков в течение --duration секунд шлёт GET на
+--path. Печатаются запросы в секунду, доля ошибок и перцентили задержки.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(name, port, args):
+    if name == 'dev':
+        return [sys.executable, 'run.py'], {'PORT': str(port), 'FLASK_DEBUG': '0'}
+    return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'], {
+        'GUNICORN_BIND': f"127.0.0.1:{port}",
+        'WEB_CONCURRENCY': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        'GUNICORN_WORKER_CLASS': args.worker_class or ('gthread' if args.threads > 1 else 'sync'),
+        'GUNICORN_ACCESS_LOG': '',
+        'GUNICORN_MAX_REQUESTS': '0'
+    }
+
+
+def wait_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not become ready in {timeout}s")
+
+
+def run_load(url, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        local_latencies = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                urllib.request.urlopen(url, timeout=10).read()
+                local_latencies.append(time.perf_counter() - started)
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0], time.perf_counter() - started
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench(name, args):
+    port = free_port()
+    command, env = server_command(name, port, args)
+    url = f"http://127.0.0.1:{port}{args.path}"
+    process = subprocess.Popen(command, env={**os.environ, **env},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(url, process)
+        run_load(url, args.concurrency, 1)  # прогрев
+        latencies, errors, elapsed = run_load(url, args.concurrency, args.duration)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    total = len(latencies) + errors
+    print(f"  {name:<10}{len(latencies) / elapsed:>10.1f}{errors / max(total, 1) * 100:>9.2f}"
+          + "".join(f"{percentile(latencies, p) * 1000:>10.2f}" for p in (50, 95, 99)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', default='dev,gunicorn', help='Comma-separated: dev, gunicorn')
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() * 2 + 1)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--worker-class', default=None, help='sync, gthread or gevent')
+    args = parser.parse_args()
+
+    print(f"GET {args.path}, {args.concurrency} clients, {args.duration}s")
+    print(f"  {'server':<10}{'req/s':>10}{'errors,%':>9}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}")
+    for name in args.servers.split(','):
+        bench(name.strip(), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Локальные заменители MongoDB и Redis для бенчмарков: mongomock и fakeredis.
+
+Подменяются только точки подключения библиотек (MongoClient в
+flask_pymongo и ConnectionPool.from_url в redis), поэтому код приложения,
+включая пулы, кэш и pub/sub, работает без изменений. Зависимости —
+в benchmarks/requirements.txt.
+"""
+import redis
+import flask_pymongo
+
+try:
+    import fakeredis
+    import mongomock
+except ImportError:  # заменители нужны только бенчмаркам
+    fakeredis = mongomock = None
+
+
+def install_mongo():
+    """Все MongoClient приложения — один mongomock-клиент в памяти процесса"""
+    if mongomock is None:
+        raise RuntimeError("mongomock is not installed: pip install -r benchmarks/requirements.txt")
+    client = mongomock.MongoClient()
+    flask_pymongo.MongoClient = lambda *args, **kwargs: client
+    return client
+
+
+def install_redis():
+    """Пулы соединений Redis (обычный и блокирующий) — соединения с общим FakeServer"""
+    if fakeredis is None:
+        raise RuntimeError("fakeredis is not installed: pip install -r benchmarks/requirements.txt")
+    server = fakeredis.FakeServer()
+
+    def from_url(cls, url, **kwargs):
+        kwargs.pop('health_check_interval', None)
+        return cls(connection_class=fakeredis.FakeConnection, server=server, **kwargs)
+
+    redis.ConnectionPool.from_url = classmethod(from_url)
+    return server
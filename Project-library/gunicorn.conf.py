@@ -0,0 +1,48 @@
+"""Конфигурация gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+
+Все параметры задаются переменными окружения. Плавная перезагрузка
+воркеров — kill -HUP <master pid>. При GUNICORN_PRELOAD=1 приложение
+загружается в master до fork, поэтому HUP перезапускает воркеры без
+перечитывания кода; для выкладки нового кода используйте USR2 (новый
+master) и затем TERM старому master или GUNICORN_PRELOAD=0.
+"""
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 5005)}")
+
+workers = _env_int('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)
+threads = _env_int('GUNICORN_THREADS', 1)
+# sync, gthread или gevent (нужен пакет gevent; для psycopg2 — ещё psycogreen)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 1000)
+
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+# Периодический перезапуск воркеров ограничивает рост памяти
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+# create_app() (db.create_all, индексы MongoDB) выполняется один раз в master
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Пустое значение отключает access-лог
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        # Без preload приложение создаётся уже в воркере
+        return
+    from app import reinit_after_fork
+
+    reinit_after_fork(server.app.wsgi())
@@ -1,6 +1,10 @@
+import os
+
 from app import create_app
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5005, host='0.0.0.0')
\ No newline at end of file
+    # Dev-сервер Werkzeug; в продакшене: gunicorn -c gunicorn.conf.py wsgi:app
+    app.run(debug=os.environ.get('FLASK_DEBUG', '0') == '1',
+            port=int(os.environ.get('PORT', 5005)), host='0.0.0.0')